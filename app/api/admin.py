@@ -0,0 +1,27 @@
+from hmac import compare_digest
+from typing import Optional
+
+from fastapi import APIRouter, Depends, Header, HTTPException
+
+from app.config import config
+from app.services.message_queue import message_queue
+
+
+async def require_admin_token(x_admin_token: Optional[str] = Header(None)) -> None:
+    """Reject requests that do not carry the configured admin token"""
+    # Without a configured token the admin routes behave as if absent
+    if not config.admin_token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    # Constant-time comparison, so the token cannot be guessed byte by byte
+    if not compare_digest((x_admin_token or "").encode(), config.admin_token.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+router = APIRouter(prefix="/admin", dependencies=[Depends(require_admin_token)])
+
+
+@router.get("/dlq")
+async def dead_letters():
+    """List messages that failed processing on every attempt"""
+    messages = message_queue.get_dead_letters()
+    return {"count": len(messages), "messages": messages}
@@ -1,8 +1,9 @@
 from fastapi import APIRouter, Request, Response, Header, HTTPException, Depends
 from typing import Optional, Dict, Any
+from urllib.parse import parse_qsl
 
-from app.messaging.twilio_adapter import TwilioWhatsAppAdapter
-from app.services.message_queue import enqueue_message
+from app.messaging.twilio_adapter import get_twilio_adapter
+from app.services.message_queue import QueueFullError, try_enqueue_message
 from app.models.user import User
 from app.models.conversation import Conversation
 from app.models.message import Message
@@ -10,7 +11,38 @@ from app.models.message import Message
 router = APIRouter(prefix="/webhook")
 
 # Initialize the messaging platform adapter
-twilio_adapter = TwilioWhatsAppAdapter()
+twilio_adapter = get_twilio_adapter()
+
+# Twilio webhook payloads are around 2 KiB; anything far larger is rejected
+# before it is buffered or parsed
+MAX_WEBHOOK_BODY_BYTES = 16 * 1024
+FORM_CONTENT_TYPE = "application/x-www-form-urlencoded"
+
+
+async def _read_form_body(request: Request) -> bytes:
+    """Read a urlencoded request body, enforcing the content type and size cap"""
+    if not request.headers.get("content-type", "").startswith(FORM_CONTENT_TYPE):
+        raise HTTPException(status_code=415, detail="Unsupported media type")
+
+    try:
+        content_length = int(request.headers.get("content-length", "0"))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid Content-Length")
+    if content_length > MAX_WEBHOOK_BODY_BYTES:
+        raise HTTPException(status_code=413, detail="Request body too large")
+
+    # Content-Length may be missing (chunked uploads) or wrong, so the cap is
+    # also enforced while reading
+    body = bytearray()
+    async for chunk in request.stream():
+        body += chunk
+        if len(body) > MAX_WEBHOOK_BODY_BYTES:
+            raise HTTPException(status_code=413, detail="Request body too large")
+    return bytes(body)
+
+
+# The webhook reply is constant, so build it once instead of per request
+_TWIML_EMPTY = Response(content=b"<Response></Response>", media_type="application/xml")
 
 
 @router.post("/whatsapp")
@@ -18,24 +50,33 @@ async def whatsapp_webhook(
     request: Request, x_twilio_signature: Optional[str] = Header(None)
 ):
     """Webhook endpoint for Twilio WhatsApp"""
-    # Get request data
-    form_data = await request.form()
-    request_data = dict(form_data)
+    body = await _read_form_body(request)
     # Get full URL for validation
     url = str(request.url)
 
-    # Validate webhook signature - note we're passing url separately
-    if not await twilio_adapter.validate_webhook(url, request_data, x_twilio_signature):
+    # Validate the signature over the raw body before parsing it
+    if not twilio_adapter.validate_signature_raw(url, body, x_twilio_signature or ""):
         raise HTTPException(status_code=401, detail="Invalid signature")
 
+    # Twilio posts application/x-www-form-urlencoded, so parse the raw body
+    # directly instead of going through the multipart-capable form parser
+    try:
+        request_data = dict(parse_qsl(body.decode("utf-8"), keep_blank_values=True))
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Malformed request body")
+
     # Parse incoming message
     message = await twilio_adapter.parse_message(request_data)
 
-    # Enqueue message for processing
-    await enqueue_message(message)
+    # Enqueueing never waits, so the TwiML ACK still goes out immediately; a
+    # full queue sheds load with a 429 instead of growing without bound
+    try:
+        try_enqueue_message(message)
+    except QueueFullError:
+        raise HTTPException(status_code=429, detail="Too many pending messages")
 
     # Return TwiML response
-    return Response(content="<Response></Response>", media_type="application/xml")
+    return _TWIML_EMPTY
 
 
 @router.post("/{platform}")
@@ -0,0 +1,48 @@
+import os
+from dataclasses import dataclass
+from typing import Optional
+
+from dotenv import load_dotenv
+
+# Pull .env into os.environ before anything reads configuration
+load_dotenv()
+
+
+@dataclass(frozen=True)
+class Config:
+    """Application settings, read from the environment once at import time"""
+
+    twilio_account_sid: Optional[str]
+    twilio_auth_token: Optional[str]
+    twilio_phone_number: Optional[str]
+    anthropic_api_key: Optional[str]
+    llm_provider: str
+    database_path: str
+    message_worker_count: int
+    message_queue_max_size: int
+    admin_token: Optional[str]
+    debug_raw: bool
+
+    @classmethod
+    def from_env(cls) -> "Config":
+        """Build the configuration from environment variables"""
+        return cls(
+            twilio_account_sid=os.getenv("TWILIO_ACCOUNT_SID"),
+            twilio_auth_token=os.getenv("TWILIO_AUTH_TOKEN"),
+            twilio_phone_number=os.getenv("TWILIO_PHONE_NUMBER"),
+            anthropic_api_key=os.getenv("ANTHROPIC_API_KEY"),
+            # Which LLMInterface implementation to use (anthropic, mock)
+            llm_provider=os.getenv("LLM_PROVIDER") or "anthropic",
+            # Default to local file in project root if not specified
+            database_path=os.getenv("DATABASE_PATH") or "ecommerce_bot.db",
+            message_worker_count=int(os.getenv("MESSAGE_WORKER_COUNT", "3")),
+            # Messages waiting for a worker before new webhooks are turned away
+            message_queue_max_size=int(os.getenv("QUEUE_MAX", "10000")),
+            # Required in the X-Admin-Token header; admin routes are off if unset
+            admin_token=os.getenv("ADMIN_TOKEN") or None,
+            # Attach the full webhook payload to parsed messages (debugging only)
+            debug_raw=bool(os.getenv("DEBUG_RAW")),
+        )
+
+
+config = Config.from_env()
@@ -1,32 +1,68 @@
-import os
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI
-from dotenv import load_dotenv
+from fastapi.responses import ORJSONResponse
 import asyncio
 import logging
 
+try:
+    import uvloop
+except ImportError:  # uvloop is not available on Windows
+    uvloop = None
+
+if uvloop is not None:
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+
+from app.config import config
+from app.api.admin import router as admin_router
 from app.api.webhook import router as webhook_router
-from app.services.message_queue import start_worker_pool
+from app.messaging.twilio_adapter import get_twilio_adapter
+from app.models.database import get_database
+from app.services.message_processor import process_message
+from app.services.message_queue import message_queue, set_processor, start_worker_pool
 
-load_dotenv()
+# Logging is configured here, by the application, rather than by the modules
+logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI(title="WhatsApp E-Commerce Bot")
 
-app.include_router(webhook_router)
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Prepare the database and workers on startup and stop them on shutdown"""
+    # Create and migrate the schema once, before any request touches it
+    await get_database().ensure_schema()
 
+    worker_count = config.message_worker_count
+    logger.info(f"Starting message worker pool with {worker_count} workers")
 
-@app.get("/health")
-async def health_check():
-    return {"status": "ok"}
+    set_processor(process_message)
 
+    # Registering workers only spawns their tasks, so await it directly and let
+    # any startup error surface instead of vanishing in a detached task
+    await start_worker_pool(worker_count)
+    logger.info("Message worker pool started successfully")
 
-@app.on_event("startup")
-async def startup_event():
-    """Start the worker pool when the app starts up"""
-    # Get the number of workers from environment or use default
-    worker_count = int(os.getenv("MESSAGE_WORKER_COUNT", "3"))
-    logger.info(f"Starting message worker pool with {worker_count} workers")
+    yield
 
-    # Start the worker pool in a background task
-    asyncio.create_task(start_worker_pool(worker_count))
-    logger.info("Message worker pool started successfully")
+    # Stop the worker pool, then close outbound HTTP clients and the database
+    # once its queued writes have committed
+    await message_queue.shutdown()
+    await get_twilio_adapter().close()
+    await get_database().writes.close()
+    get_database().close()
+
+
+app = FastAPI(
+    title="WhatsApp E-Commerce Bot",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
+
+app.include_router(webhook_router)
+app.include_router(admin_router)
+
+
+@app.get("/health")
+async def health_check():
+    # A plain attribute read, cheap enough for frequent scraping
+    return {"status": "ok", "queue_length": message_queue.length}
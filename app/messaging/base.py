@@ -28,3 +28,7 @@ class MessagingPlatform(ABC):
     ) -> Dict[str, Any]:
         """Send media message to user"""
         pass
+
+    async def close(self) -> None:
+        """Release any resources held by the adapter"""
+        pass
@@ -1,28 +1,185 @@
-from typing import Dict, Any, Optional
-from dotenv import dotenv_values
+import asyncio
+import base64
+import hashlib
+import hmac
+from functools import lru_cache
+from typing import Awaitable, Callable, Dict, Any, Iterable, List, Optional, Set, Tuple
+from urllib.parse import parse_qsl, urlsplit
 
-from twilio.rest import Client
-from twilio.request_validator import RequestValidator
+import httpx
 
+from app.config import config
 from app.messaging.base import MessagingPlatform
 
 
+TWILIO_API_BASE_URL = "https://api.twilio.com/2010-04-01/Accounts"
+
+WHATSAPP_PREFIX = "whatsapp:"
+
+
+def _other_port_form(url: str) -> str:
+    """Return url without its port if it has one, else with the default port
+
+    A proxy in front of the app may add or remove the port, so like Twilio's
+    RequestValidator the signature is also checked against the other form.
+    """
+    parts = urlsplit(url)
+    try:
+        port = parts.port
+    except ValueError:
+        return url
+    if port is not None:
+        netloc = parts.netloc.rsplit(":", 1)[0]
+    else:
+        netloc = f"{parts.netloc}:{443 if parts.scheme == 'https' else 80}"
+    return parts._replace(netloc=netloc).geturl()
+
+
+@lru_cache(maxsize=4096)
+def _whatsapp_address(phone_number: str) -> str:
+    """Return the Twilio WhatsApp address for a phone number"""
+    return f"{WHATSAPP_PREFIX}{phone_number}"
+
+
+class TwilioSendBatcher:
+    """Coalesce outbound Twilio requests and issue each batch concurrently"""
+
+    def __init__(
+        self,
+        send: Callable[[Dict[str, Any]], Awaitable[Dict[str, Any]]],
+        max_batch: int = 32,
+        max_wait_ms: int = 20,
+    ):
+        self._send = send
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        # Built on first use, inside the running loop; before Python 3.10 an
+        # asyncio.Queue binds to the event loop current when it is created
+        self._pending: Optional[
+            "asyncio.Queue[Tuple[Dict[str, Any], asyncio.Future]]"
+        ] = None
+        self._worker: Optional[asyncio.Task] = None
+        # Every caller still waiting, queued or in a batch being sent, so
+        # close() can fail them instead of leaving them hanging
+        self._waiting: Set[asyncio.Future] = set()
+
+    @property
+    def _queue(self) -> "asyncio.Queue[Tuple[Dict[str, Any], asyncio.Future]]":
+        if self._pending is None:
+            self._pending = asyncio.Queue()
+        return self._pending
+
+    async def submit(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """Queue a request and wait for its result"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiting.add(future)
+        future.add_done_callback(self._waiting.discard)
+        await self._queue.put((data, future))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[Dict[str, Any], asyncio.Future]]:
+        """Wait for one request, then collect more for up to max_wait seconds"""
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+        return items
+
+    async def _run(self) -> None:
+        """Drain the queue batch by batch"""
+        while True:
+            items = await self._next_batch()
+            results = await asyncio.gather(
+                *(self._send(data) for data, _ in items), return_exceptions=True
+            )
+            for (_, future), result in zip(items, results):
+                if future.done():
+                    # The caller gave up waiting
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+
+    async def close(self) -> None:
+        """Stop the batching worker and fail every send it has not finished"""
+        if self._worker is not None and not self._worker.done():
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
+
+        if self._pending is not None:
+            while not self._pending.empty():
+                self._pending.get_nowait()
+        for future in list(self._waiting):
+            if not future.done():
+                future.set_exception(RuntimeError("Twilio send batcher was closed"))
+
+
 class TwilioWhatsAppAdapter(MessagingPlatform):
     """Twilio WhatsApp messaging platform adapter."""
 
     def __init__(self):
-        config = dotenv_values()
-        self.account_sid = config.get("TWILIO_ACCOUNT_SID")
-        self.auth_token = config.get("TWILIO_AUTH_TOKEN")
-        self.from_number = config.get("TWILIO_PHONE_NUMBER")
+        self.account_sid = config.twilio_account_sid
+        self.auth_token = config.twilio_auth_token
+        self.from_number = config.twilio_phone_number
 
         if not all([self.account_sid, self.auth_token, self.from_number]):
             raise ValueError(
                 "Twilio credentials not properly configured. Check environment variables."
             )
 
-        self.client = Client(self.account_sid, self.auth_token)
-        self.validator = RequestValidator(self.auth_token)
+        # Talk to the Twilio REST API directly over a shared keep-alive client so
+        # sends don't block the event loop the way the sync SDK client does
+        self._http = httpx.AsyncClient(
+            http2=True,
+            auth=(self.account_sid, self.auth_token),
+            base_url=f"{TWILIO_API_BASE_URL}/{self.account_sid}",
+            limits=httpx.Limits(max_keepalive_connections=50, max_connections=100),
+        )
+        self._batcher = TwilioSendBatcher(self._create_message)
+        self._auth_token = self.auth_token.encode("utf-8")
+        self._whatsapp_from = _whatsapp_address(self.from_number)
+
+    def _sign(self, url: str, params: Iterable[Tuple[str, str]]) -> str:
+        """Compute Twilio's X-Twilio-Signature for a URL and its POST params"""
+        # Twilio signs the URL followed by every distinct key/value pair,
+        # sorted by key and then value
+        buf = [url]
+        for key, value in sorted(set(params)):
+            buf.append(key)
+            buf.append(value)
+        mac = hmac.new(self._auth_token, "".join(buf).encode("utf-8"), hashlib.sha1)
+        return base64.b64encode(mac.digest()).decode("ascii")
+
+    def _signature_matches(
+        self, url: str, params: List[Tuple[str, str]], signature: str
+    ) -> bool:
+        """Check a signature against the URL as received, then its other port form"""
+        if hmac.compare_digest(self._sign(url, params), signature):
+            return True
+        other = _other_port_form(url)
+        if other == url:
+            return False
+        return hmac.compare_digest(self._sign(other, params), signature)
 
     async def validate_webhook(
         self, url: str, request_data: Dict[str, Any], signature: Optional[str]
@@ -30,44 +187,80 @@ class TwilioWhatsAppAdapter(MessagingPlatform):
         """Validate incoming webhook request signature"""
         if not signature:
             return False
-        return self.validator.validate(url, request_data, signature)
+        return self._signature_matches(url, list(request_data.items()), signature)
+
+    def validate_signature_raw(
+        self, url: str, body: bytes, signature: Optional[str]
+    ) -> bool:
+        """Validate a webhook signature against the raw urlencoded POST body
+
+        Signing the pairs parsed straight from the body keeps repeated keys,
+        which a dict of the form data would collapse.
+        """
+        if not signature:
+            return False
+        try:
+            params = parse_qsl(body.decode("utf-8"), keep_blank_values=True)
+        except UnicodeDecodeError:
+            return False
+        return self._signature_matches(url, params, signature)
 
     async def parse_message(self, request_data: Dict[str, Any]) -> Dict[str, Any]:
         """Parse Twilio WhatsApp message into standardized format"""
+        sender = request_data.get("From", "")
+        if sender.startswith(WHATSAPP_PREFIX):
+            sender = sender[len(WHATSAPP_PREFIX) :]
+
         standardized_message = {
             "platform": "whatsapp",
-            "phone_number": request_data.get("From", "").replace("whatsapp:", ""),
+            "phone_number": sender,
             "message_id": request_data.get("MessageSid", ""),
             "content": request_data.get("Body", ""),
             "media_url": request_data.get("MediaUrl0", None),
             "message_type": "media" if request_data.get("MediaUrl0") else "text",
             "timestamp": request_data.get("timestamp", ""),
-            "metadata": {"message_sid": request_data.get("MessageSid", "")},
-            "raw_data": request_data,
         }
+        if config.debug_raw:
+            standardized_message["raw_data"] = request_data
 
         return standardized_message
 
+    async def _create_message(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """POST a message resource to the Twilio REST API"""
+        response = await self._http.post("/Messages.json", data=data)
+        response.raise_for_status()
+        payload = response.json()
+        return {"message_id": payload["sid"], "status": payload["status"]}
+
     async def send_message(self, phone_number: str, message: str) -> Dict[str, Any]:
         """Send text message to user via Twilio WhatsApp"""
-        whatsapp_phone = f"whatsapp:{phone_number}"
-        whatsapp_from = f"whatsapp:{self.from_number}"
+        whatsapp_phone = _whatsapp_address(phone_number)
+        whatsapp_from = self._whatsapp_from
 
-        message_response = self.client.messages.create(
-            body=message, from_=whatsapp_from, to=whatsapp_phone
+        return await self._batcher.submit(
+            {"To": whatsapp_phone, "From": whatsapp_from, "Body": message}
         )
 
-        return {"message_id": message_response.sid, "status": message_response.status}
-
     async def send_media(
         self, phone_number: str, media_url: str, caption: Optional[str] = None
     ) -> Dict[str, Any]:
         """Send media message to user via Twilio WhatsApp"""
-        whatsapp_phone = f"whatsapp:{phone_number}"
-        whatsapp_from = f"whatsapp:{self.from_number}"
+        whatsapp_phone = _whatsapp_address(phone_number)
+        whatsapp_from = self._whatsapp_from
+
+        data = {"To": whatsapp_phone, "From": whatsapp_from, "MediaUrl": media_url}
+        if caption:
+            data["Body"] = caption
+
+        return await self._batcher.submit(data)
+
+    async def close(self) -> None:
+        """Stop the send batcher and close the underlying HTTP client"""
+        await self._batcher.close()
+        await self._http.aclose()
 
-        message_response = self.client.messages.create(
-            media_url=[media_url], body=caption, from_=whatsapp_from, to=whatsapp_phone
-        )
 
-        return {"message_id": message_response.sid, "status": message_response.status}
+@lru_cache(maxsize=1)
+def get_twilio_adapter() -> TwilioWhatsAppAdapter:
+    """Return the process-wide Twilio adapter, creating it on first use"""
+    return TwilioWhatsAppAdapter()
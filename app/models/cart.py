@@ -1,13 +1,29 @@
-import uuid
-from typing import Optional, Dict, Any, List
-
-from app.models.database import database
-from app.models.product import Product
+import sqlite3
+from typing import Optional, Dict, Any, List, Tuple
+
+from app.models.database import get_database, new_id, run_in_thread
+from app.models.product import Product, split_categories
+
+# A cart's items with their products in a single query. The window SUM puts
+# the cart total on every row, so callers that need both skip a second query;
+# items whose product is gone contribute nothing, as in calculate_total.
+_ITEMS_WITH_TOTAL_SQL = """
+	SELECT ci.id, ci.conversation_id, ci.product_id, ci.quantity,
+		p.id AS p_id, p.name, p.description, p.price, p.image_url, p.in_stock,
+		(SELECT GROUP_CONCAT(pc.category, char(31)) FROM product_categories pc
+		 WHERE pc.product_id = p.id) AS categories,
+		SUM(p.price * ci.quantity) OVER () AS total
+	FROM cart_items ci
+	LEFT JOIN products p ON p.id = ci.product_id
+	WHERE ci.conversation_id = ?
+	"""
 
 
 class CartItem:
     """Cart item model representing a product in a cart"""
 
+    __slots__ = ("id", "conversation_id", "product_id", "quantity", "product")
+
     def __init__(self, id: str, conversation_id: str, product_id: str, quantity: int):
         self.id = id
         self.conversation_id = conversation_id
@@ -41,78 +57,107 @@ class Cart:
     @classmethod
     async def get_items(cls, conversation_id: str) -> List[CartItem]:
         """Get all items in a cart for a conversation"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(cls._get_items_sync, conversation_id)
 
-        cursor.execute(
-            "SELECT * FROM cart_items WHERE conversation_id = ?", (conversation_id,)
-        )
+    @classmethod
+    def _get_items_sync(cls, conversation_id: str) -> List[CartItem]:
+        items, _ = cls._get_items_with_total_sync(conversation_id)
+        return items
+
+    @classmethod
+    async def get_items_with_total(
+        cls, conversation_id: str
+    ) -> Tuple[List[CartItem], float]:
+        """Get a cart's items and its total price in one query"""
+        return await run_in_thread(cls._get_items_with_total_sync, conversation_id)
+
+    @classmethod
+    def _get_items_with_total_sync(
+        cls, conversation_id: str
+    ) -> Tuple[List[CartItem], float]:
+        with get_database().connection() as conn:
+            rows = conn.execute(_ITEMS_WITH_TOTAL_SQL, (conversation_id,)).fetchall()
 
         items = []
-        for row in cursor.fetchall():
+        for row in rows:
             item = CartItem(
                 id=row['id'],
                 conversation_id=row['conversation_id'],
                 product_id=row['product_id'],
                 quantity=row['quantity'],
             )
-            # Load the product
-            await item.get_product()
+            if row['p_id'] is not None:
+                item.product = Product(
+                    id=row['p_id'],
+                    name=row['name'],
+                    description=row['description'],
+                    price=row['price'],
+                    image_url=row['image_url'],
+                    in_stock=bool(row['in_stock']),
+                    categories=split_categories(row['categories']),
+                )
             items.append(item)
 
-        return items
+        # Every row carries the same window total; an empty cart has no rows
+        total = float(rows[0]['total'] or 0.0) if rows else 0.0
+        return items, total
 
     @classmethod
     async def add_item(
         cls, conversation_id: str, product_id: str, quantity: int = 1
     ) -> CartItem:
         """Add an item to the cart"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(
+            cls._add_item_sync, conversation_id, product_id, quantity
+        )
 
+    @classmethod
+    def _add_item_sync(
+        cls, conversation_id: str, product_id: str, quantity: int = 1
+    ) -> CartItem:
         # Check if product exists
-        product = await Product.get_by_id(product_id)
+        product = Product._get_by_id_sync(product_id)
         if not product:
             raise ValueError(f"Product {product_id} not found")
 
-        # Check if item already in cart
-        cursor.execute(
-            "SELECT * FROM cart_items WHERE conversation_id = ? AND product_id = ?",
-            (conversation_id, product_id),
-        )
-
-        existing_item = cursor.fetchone()
-
-        if existing_item:
-            # Update quantity
-            new_quantity = existing_item['quantity'] + quantity
+        with get_database().transaction() as cursor:
+            # Check if item already in cart
             cursor.execute(
-                "UPDATE cart_items SET quantity = ? WHERE id = ?",
-                (new_quantity, existing_item['id']),
+                "SELECT * FROM cart_items WHERE conversation_id = ? AND product_id = ?",
+                (conversation_id, product_id),
             )
 
-            item = CartItem(
-                id=existing_item['id'],
-                conversation_id=conversation_id,
-                product_id=product_id,
-                quantity=new_quantity,
-            )
-        else:
-            # Add new item
-            item_id = str(uuid.uuid4())
-            cursor.execute(
-                "INSERT INTO cart_items (id, conversation_id, product_id, quantity) VALUES (?, ?, ?, ?)",
-                (item_id, conversation_id, product_id, quantity),
-            )
-
-            item = CartItem(
-                id=item_id,
-                conversation_id=conversation_id,
-                product_id=product_id,
-                quantity=quantity,
-            )
+            existing_item = cursor.fetchone()
+
+            if existing_item:
+                # Update quantity
+                new_quantity = existing_item['quantity'] + quantity
+                cursor.execute(
+                    "UPDATE cart_items SET quantity = ? WHERE id = ?",
+                    (new_quantity, existing_item['id']),
+                )
+
+                item = CartItem(
+                    id=existing_item['id'],
+                    conversation_id=conversation_id,
+                    product_id=product_id,
+                    quantity=new_quantity,
+                )
+            else:
+                # Add new item
+                item_id = new_id()
+                cursor.execute(
+                    "INSERT INTO cart_items (id, conversation_id, product_id, quantity) VALUES (?, ?, ?, ?)",
+                    (item_id, conversation_id, product_id, quantity),
+                )
+
+                item = CartItem(
+                    id=item_id,
+                    conversation_id=conversation_id,
+                    product_id=product_id,
+                    quantity=quantity,
+                )
 
-        conn.commit()
         item.product = product
         return item
 
@@ -121,56 +166,74 @@ class Cart:
         cls, conversation_id: str, product_id: str, quantity: Optional[int] = None
     ) -> bool:
         """Remove an item from the cart"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
-
-        # Check if item exists in cart
-        cursor.execute(
-            "SELECT * FROM cart_items WHERE conversation_id = ? AND product_id = ?",
-            (conversation_id, product_id),
+        return await run_in_thread(
+            cls._remove_item_sync, conversation_id, product_id, quantity
         )
 
-        existing_item = cursor.fetchone()
-
-        if not existing_item:
-            return False
-
-        if quantity is None or quantity >= existing_item['quantity']:
-            # Remove item completely
-            cursor.execute(
-                "DELETE FROM cart_items WHERE id = ?", (existing_item['id'],)
-            )
-        else:
-            # Decrease quantity
-            new_quantity = existing_item['quantity'] - quantity
+    @classmethod
+    def _remove_item_sync(
+        cls, conversation_id: str, product_id: str, quantity: Optional[int] = None
+    ) -> bool:
+        with get_database().transaction() as cursor:
+            # Check if item exists in cart
             cursor.execute(
-                "UPDATE cart_items SET quantity = ? WHERE id = ?",
-                (new_quantity, existing_item['id']),
+                "SELECT * FROM cart_items WHERE conversation_id = ? AND product_id = ?",
+                (conversation_id, product_id),
             )
 
-        conn.commit()
+            existing_item = cursor.fetchone()
+
+            if not existing_item:
+                return False
+
+            if quantity is None or quantity >= existing_item['quantity']:
+                # Remove item completely
+                cursor.execute(
+                    "DELETE FROM cart_items WHERE id = ?", (existing_item['id'],)
+                )
+            else:
+                # Decrease quantity
+                new_quantity = existing_item['quantity'] - quantity
+                cursor.execute(
+                    "UPDATE cart_items SET quantity = ? WHERE id = ?",
+                    (new_quantity, existing_item['id']),
+                )
+
         return True
 
     @classmethod
     async def clear(cls, conversation_id: str) -> None:
         """Clear all items from the cart"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        await run_in_thread(cls._clear_sync, conversation_id)
 
+    @classmethod
+    def _clear_sync(cls, conversation_id: str) -> None:
+        with get_database().connection(write=True) as conn:
+            cls.delete_items(conn.cursor(), conversation_id)
+
+    @staticmethod
+    def delete_items(cursor: sqlite3.Cursor, conversation_id: str) -> None:
+        """Delete a cart's items on an open cursor, within the caller's transaction"""
         cursor.execute(
             "DELETE FROM cart_items WHERE conversation_id = ?", (conversation_id,)
         )
 
-        conn.commit()
-
     @classmethod
     async def calculate_total(cls, conversation_id: str) -> float:
         """Calculate the total price of items in the cart"""
-        items = await cls.get_items(conversation_id)
-        total = 0.0
+        return await run_in_thread(cls._calculate_total_sync, conversation_id)
 
-        for item in items:
-            if item.product:
-                total += item.product.price * item.quantity
-
-        return total
+    @classmethod
+    def _calculate_total_sync(cls, conversation_id: str) -> float:
+        with get_database().connection() as conn:
+            row = conn.execute(
+                """
+				SELECT COALESCE(SUM(p.price * ci.quantity), 0.0) AS total
+				FROM cart_items ci
+				JOIN products p ON p.id = ci.product_id
+				WHERE ci.conversation_id = ?
+				""",
+                (conversation_id,),
+            ).fetchone()
+
+        return float(row['total'])
@@ -1,14 +1,30 @@
-import uuid
 from datetime import datetime
-from typing import Optional, Dict, Any, List, Union
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Union
 
-from app.models.database import database
+from app.models.database import get_database, new_id, run_in_thread
 from app.models.user import User
 
+if TYPE_CHECKING:
+    from app.models.message import Message
+
 
 class Conversation:
     """Conversation model representing a chat session"""
 
+    __slots__ = (
+        "id",
+        "user_id",
+        "context",
+        "active_product_id",
+        "created_at",
+        "updated_at",
+        # (context, active_product_id) as last read from or written to the
+        # database, so update() can skip writes that change nothing
+        "_saved",
+        # Messages added but not yet written; see flush_pending()
+        "_pending",
+    )
+
     def __init__(
         self,
         id: str,
@@ -24,45 +40,53 @@ class Conversation:
         self.active_product_id = active_product_id
         self.created_at = created_at or datetime.now()
         self.updated_at = updated_at or datetime.now()
+        self._saved = (self.context, self.active_product_id)
+        self._pending: List["Message"] = []
 
     @classmethod
     async def create(cls, user_id: str) -> "Conversation":
         """Create a new conversation"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        conversation = await run_in_thread(cls._create_sync, user_id)
 
-        conversation_id = str(uuid.uuid4())
-        now = datetime.now().isoformat()
+        # Update user's active conversation through User so its cache stays
+        # current
+        user = await User.get_by_phone(user_id)
+        if user:
+            await user.update_active_conversation(conversation.id)
 
-        cursor.execute(
-            "INSERT INTO conversations (id, user_id, context, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
-            (conversation_id, user_id, "{}", now, now),
-        )
+        return conversation
 
-        conn.commit()
+    @classmethod
+    def _create_sync(cls, user_id: str) -> "Conversation":
+        conversation_id = new_id()
+        now = datetime.now()
+        timestamp = now.timestamp()
 
-        # Update user's active conversation
-        user = await User.get_by_phone(user_id)
-        if user:
-            await user.update_active_conversation(conversation_id)
+        with get_database().connection(write=True) as conn:
+            conn.execute(
+                "INSERT INTO conversations (id, user_id, context, created_at, updated_at) VALUES (?, ?, ?, ?, ?)",
+                (conversation_id, user_id, "{}", timestamp, timestamp),
+            )
 
         return Conversation(
             id=conversation_id,
             user_id=user_id,
             context="{}",
-            created_at=datetime.fromisoformat(now),
-            updated_at=datetime.fromisoformat(now),
+            created_at=now,
+            updated_at=now,
         )
 
     @classmethod
     async def get_by_id(cls, conversation_id: str) -> Optional["Conversation"]:
         """Get a conversation by ID"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(cls._get_by_id_sync, conversation_id)
 
-        cursor.execute("SELECT * FROM conversations WHERE id = ?", (conversation_id,))
-
-        conversation_data = cursor.fetchone()
+    @classmethod
+    def _get_by_id_sync(cls, conversation_id: str) -> Optional["Conversation"]:
+        with get_database().connection() as conn:
+            conversation_data = conn.execute(
+                "SELECT * FROM conversations WHERE id = ?", (conversation_id,)
+            ).fetchone()
         if not conversation_data:
             return None
 
@@ -71,41 +95,47 @@ class Conversation:
             user_id=conversation_data['user_id'],
             context=conversation_data['context'],
             active_product_id=conversation_data['active_product_id'],
-            created_at=datetime.fromisoformat(conversation_data['created_at']),
-            updated_at=datetime.fromisoformat(conversation_data['updated_at']),
+            created_at=datetime.fromtimestamp(conversation_data['created_at']),
+            updated_at=datetime.fromtimestamp(conversation_data['updated_at']),
         )
 
     @classmethod
     async def get_active_for_user(cls, user_id: str) -> Optional["Conversation"]:
         """Get the active conversation for a user"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(cls._get_active_for_user_sync, user_id)
 
-        cursor.execute(
-            "SELECT active_conversation_id FROM users WHERE phone_number = ?",
-            (user_id,),
-        )
-
-        result = cursor.fetchone()
+    @classmethod
+    def _get_active_for_user_sync(cls, user_id: str) -> Optional["Conversation"]:
+        with get_database().connection() as conn:
+            result = conn.execute(
+                "SELECT active_conversation_id FROM users WHERE phone_number = ?",
+                (user_id,),
+            ).fetchone()
         if not result or not result['active_conversation_id']:
             return None
 
-        return await cls.get_by_id(result['active_conversation_id'])
+        return cls._get_by_id_sync(result['active_conversation_id'])
 
     async def update(self) -> None:
-        """Update the conversation in the database"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        """Update the conversation in the database, if anything changed"""
+        # Most turns leave the context as it was; new messages already bump
+        # updated_at through the messages trigger
+        state = (self.context, self.active_product_id)
+        if state == self._saved:
+            return
 
-        now = datetime.now().isoformat()
-        self.updated_at = datetime.fromisoformat(now)
+        self.updated_at = datetime.now()
 
-        cursor.execute(
+        await get_database().writes.execute(
             "UPDATE conversations SET context = ?, active_product_id = ?, updated_at = ? WHERE id = ?",
-            (self.context, self.active_product_id, now, self.id),
+            (
+                self.context,
+                self.active_product_id,
+                self.updated_at.timestamp(),
+                self.id,
+            ),
         )
-
-        conn.commit()
+        self._saved = state
 
     async def add_message(
         self,
@@ -118,10 +148,14 @@ class Conversation:
         metadata: Optional[Dict[str, Any]] = None,
         raw_data: Optional[Dict[str, Any]] = None,
     ) -> str:
-        """Add a message to the conversation"""
+        """Add a message to the conversation
+
+        The message is held until flush_pending() writes every pending message
+        in one transaction. get_messages() already includes it.
+        """
         from app.models.message import Message
 
-        message = await Message.create(
+        message = Message.new(
             conversation_id=self.id,
             role=role,
             content=content,
@@ -132,14 +166,27 @@ class Conversation:
             metadata=metadata,
             raw_data=raw_data,
         )
+        self._pending.append(message)
 
         self.updated_at = message.timestamp
 
         return message.id
 
-    async def get_messages(self, limit: int = 10) -> List[Dict[str, Any]]:
-        """Get recent messages from the conversation"""
+    async def flush_pending(self) -> None:
+        """Write all pending messages in one transaction, in the order added"""
+        if not self._pending:
+            return
+
+        from app.models.message import Message
+
+        pending, self._pending = self._pending, []
+        await Message.create_many(pending)
+
+    async def get_messages(self, limit: int = 20) -> List[Dict[str, Any]]:
+        """Get recent messages from the conversation, including pending ones"""
         from app.models.message import Message
 
         messages = await Message.get_messages_for_conversation(self.id, limit)
-        return [message.to_dict() for message in messages]
+        # Pending messages are newer than anything stored
+        messages.extend(self._pending)
+        return [message.to_dict() for message in messages[-limit:]]
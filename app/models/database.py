@@ -1,45 +1,439 @@
+import asyncio
+import os
+import queue
 import sqlite3
-from typing import Dict, Any, List, Optional
-from dotenv import dotenv_values
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
+
+from app.config import config
+
+# Applied to every new connection. WAL lets readers proceed during writes and,
+# with synchronous=NORMAL, drops the fsync on every commit. All of these are
+# safe to re-run; journal_mode=WAL is persisted in the database file.
+_CONNECTION_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",
+    "PRAGMA cache_size=-64000",  # 64 MB page cache
+    "PRAGMA busy_timeout=5000",
+)
+
+# Compiled statements kept per connection, keyed by SQL text (default is 128).
+# Pooled connections live for the whole process, so a roomy cache keeps every
+# hot query compiled, including the ones built per IN-list length.
+_STATEMENT_CACHE_SIZE = 512
+
+# Upper bound on concurrently open reader connections
+_READER_POOL_SIZE = (os.cpu_count() or 4) * 2
+
+T = TypeVar("T")
+
+# Migrations for databases created by earlier versions, applied in order and
+# tracked with PRAGMA user_version
+_MIGRATIONS = (
+    # 1: conversation timestamps move from local ISO strings to epoch seconds
+    (
+        "UPDATE conversations"
+        " SET created_at = (julianday(created_at, 'utc') - 2440587.5) * 86400.0"
+        " WHERE typeof(created_at) = 'text'",
+        "UPDATE conversations"
+        " SET updated_at = (julianday(updated_at, 'utc') - 2440587.5) * 86400.0"
+        " WHERE typeof(updated_at) = 'text'",
+    ),
+    # 2: rebuild product_categories as a WITHOUT ROWID table clustered on its
+    # primary key
+    (
+        """
+		CREATE TABLE product_categories_new (
+			product_id TEXT,
+			category TEXT,
+			PRIMARY KEY (product_id, category),
+			FOREIGN KEY (product_id) REFERENCES products (id)
+		) WITHOUT ROWID
+		""",
+        "INSERT OR IGNORE INTO product_categories_new (product_id, category)"
+        " SELECT product_id, category FROM product_categories",
+        "DROP TABLE product_categories",
+        "ALTER TABLE product_categories_new RENAME TO product_categories",
+    ),
+    # 3: message and order timestamps move to epoch seconds as well
+    (
+        "UPDATE messages"
+        " SET timestamp = (julianday(timestamp, 'utc') - 2440587.5) * 86400.0"
+        " WHERE typeof(timestamp) = 'text'",
+        "UPDATE orders"
+        " SET created_at = (julianday(created_at, 'utc') - 2440587.5) * 86400.0"
+        " WHERE typeof(created_at) = 'text'",
+        "UPDATE orders"
+        " SET updated_at = (julianday(updated_at, 'utc') - 2440587.5) * 86400.0"
+        " WHERE typeof(updated_at) = 'text'",
+    ),
+    # 4: index the existing catalog in the products_fts full-text table
+    (
+        "DELETE FROM products_fts",
+        "INSERT INTO products_fts (product_id, name, description)"
+        " SELECT id, name, description FROM products",
+    ),
+    # 5: user timestamps move to epoch seconds. created_at only ever came from
+    # the UTC CURRENT_TIMESTAMP default; last_interaction was written as local
+    # time by the model.
+    (
+        "UPDATE users"
+        " SET created_at = (julianday(created_at) - 2440587.5) * 86400.0"
+        " WHERE typeof(created_at) = 'text'",
+        "UPDATE users"
+        " SET last_interaction"
+        " = (julianday(last_interaction, 'utc') - 2440587.5) * 86400.0"
+        " WHERE typeof(last_interaction) = 'text'",
+    ),
+    # 6: rebuild users so new rows default to epoch seconds too; the old
+    # columns kept their CURRENT_TIMESTAMP text defaults
+    (
+        """
+		CREATE TABLE users_new (
+			phone_number TEXT PRIMARY KEY,
+			name TEXT,
+			created_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			last_interaction REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			active_conversation_id TEXT
+		)
+		""",
+        "INSERT INTO users_new"
+        " (phone_number, name, created_at, last_interaction, active_conversation_id)"
+        " SELECT phone_number, name, created_at, last_interaction,"
+        " active_conversation_id FROM users",
+        "DROP TABLE users",
+        "ALTER TABLE users_new RENAME TO users",
+    ),
+    # 7: rebuild conversations with epoch defaults as well. The message
+    # trigger refers to the table, so it is dropped first and recreated with
+    # the rest of the schema.
+    (
+        "DROP TRIGGER IF EXISTS trg_msg_touch_conv",
+        """
+		CREATE TABLE conversations_new (
+			id TEXT PRIMARY KEY,
+			user_id TEXT,
+			context TEXT,
+			active_product_id TEXT,
+			created_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			updated_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			FOREIGN KEY (user_id) REFERENCES users (phone_number)
+		)
+		""",
+        "INSERT INTO conversations_new"
+        " (id, user_id, context, active_product_id, created_at, updated_at)"
+        " SELECT id, user_id, context, active_product_id, created_at, updated_at"
+        " FROM conversations",
+        "DROP TABLE conversations",
+        "ALTER TABLE conversations_new RENAME TO conversations",
+    ),
+    # 8: rebuild messages and orders with epoch defaults; dropping the old
+    # tables drops their indexes and the message trigger, which are recreated
+    # with the rest of the schema
+    (
+        """
+		CREATE TABLE messages_new (
+			id TEXT PRIMARY KEY,
+			conversation_id TEXT,
+			role TEXT,
+			content TEXT,
+			phone_number TEXT,
+			media_url TEXT,
+			message_type TEXT DEFAULT 'text',
+			platform TEXT DEFAULT 'whatsapp',
+			metadata BLOB,
+			raw_data BLOB,
+			timestamp REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			FOREIGN KEY (conversation_id) REFERENCES conversations (id)
+		)
+		""",
+        "INSERT INTO messages_new"
+        " (id, conversation_id, role, content, phone_number, media_url,"
+        " message_type, platform, metadata, raw_data, timestamp)"
+        " SELECT id, conversation_id, role, content, phone_number, media_url,"
+        " message_type, platform, metadata, raw_data, timestamp FROM messages",
+        "DROP TABLE messages",
+        "ALTER TABLE messages_new RENAME TO messages",
+        """
+		CREATE TABLE orders_new (
+			id TEXT PRIMARY KEY,
+			user_id TEXT,
+			total_amount REAL,
+			status TEXT,
+			created_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			updated_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			FOREIGN KEY (user_id) REFERENCES users (phone_number)
+		)
+		""",
+        "INSERT INTO orders_new"
+        " (id, user_id, total_amount, status, created_at, updated_at)"
+        " SELECT id, user_id, total_amount, status, created_at, updated_at"
+        " FROM orders",
+        "DROP TABLE orders",
+        "ALTER TABLE orders_new RENAME TO orders",
+    ),
+)
+
+
+def new_id() -> str:
+    """Generate a time-ordered UUIDv7 string for use as a primary key
+
+    The leading 48 bits are the Unix time in milliseconds, so new rows land at
+    the end of the primary key B-tree instead of on random pages.
+    """
+    timestamp_ms = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), "big")
+    value = (
+        (timestamp_ms & 0xFFFF_FFFF_FFFF) << 80
+        | 0x7 << 76  # version
+        | (rand >> 68) << 64  # rand_a, 12 bits
+        | 0b10 << 62  # RFC 9562 variant
+        | rand & 0x3FFF_FFFF_FFFF_FFFF  # rand_b, 62 bits
+    )
+    return str(uuid.UUID(int=value))
+
+
+async def run_in_thread(fn: Callable[..., T], *args: Any) -> T:
+    """Run blocking database work in the default thread pool
+
+    Model methods are async but sqlite3 is not, so the queries run off the
+    event loop, each on its own pooled connection.
+    """
+    return await asyncio.to_thread(fn, *args)
+
+
+class WriteBatcher:
+    """Coalesce single-statement writes into shared transactions
+
+    Writes queued within max_wait_ms of each other, up to max_batch of them,
+    commit together in one BEGIN IMMEDIATE transaction, so a burst of
+    messages pays for one commit instead of one per statement. A single
+    worker applies batches in submission order.
+    """
+
+    def __init__(self, db: "Database", max_batch: int = 64, max_wait_ms: int = 5):
+        self._db = db
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._queue: "asyncio.Queue[Tuple[str, Any, asyncio.Future]]" = (
+            asyncio.Queue()
+        )
+        self._worker: Optional[asyncio.Task] = None
+
+    async def execute(self, sql: str, params: Any = ()) -> List[Any]:
+        """Queue a write and wait for it to commit, returning any RETURNING rows"""
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((sql, params, future))
+        return await future
+
+    async def _next_batch(self) -> List[Tuple[str, Any, asyncio.Future]]:
+        """Wait for one write, then collect more for up to max_wait seconds"""
+        loop = asyncio.get_running_loop()
+        items = [await self._queue.get()]
+        deadline = loop.time() + self.max_wait
+
+        while len(items) < self.max_batch:
+            try:
+                items.append(self._queue.get_nowait())
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+        return items
+
+    async def _run(self) -> None:
+        """Commit the queue batch by batch"""
+        while True:
+            items = await self._next_batch()
+            statements = [(sql, params) for sql, params, _ in items]
+            try:
+                results = await run_in_thread(self._apply, statements)
+            except Exception as exc:
+                results = [exc] * len(items)
+
+            for (_, _, future), result in zip(items, results):
+                if future.done():
+                    # The caller gave up waiting
+                    continue
+                if isinstance(result, BaseException):
+                    future.set_exception(result)
+                else:
+                    future.set_result(result)
+            for _ in items:
+                self._queue.task_done()
+
+    def _apply(self, statements: Sequence[Tuple[str, Any]]) -> List[Any]:
+        """Run a batch in one transaction, isolating failures if it aborts"""
+        try:
+            with self._db.transaction() as cursor:
+                return [
+                    cursor.execute(sql, params).fetchall()
+                    for sql, params in statements
+                ]
+        except sqlite3.Error as exc:
+            if len(statements) == 1:
+                return [exc]
+
+        # One statement aborted the shared transaction, so rerun each on its
+        # own and let only the failing write report an error
+        results: List[Any] = []
+        for sql, params in statements:
+            try:
+                with self._db.transaction() as cursor:
+                    results.append(cursor.execute(sql, params).fetchall())
+            except sqlite3.Error as exc:
+                results.append(exc)
+        return results
+
+    async def close(self) -> None:
+        """Wait for queued writes to commit, then stop the worker"""
+        if self._worker is not None and not self._worker.done():
+            await self._queue.join()
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+        self._worker = None
 
 
 class Database:
-    """SQLite database connection manager"""
-
-    def __init__(self, db_path: str = None):
-        config = dotenv_values()
-        self.db_path = db_path or config.get("DATABASE_PATH")
-        if not self.db_path:
-            # Default to local file in project root if not specified
-            self.db_path = "ecommerce_bot.db"
-        self.conn = None
-        self.create_tables()
-
-    def get_connection(self):
-        """Get a database connection"""
-        if self.conn is None:
-            # Ensure parent directory exists
-            import os
-
-            parent_dir = os.path.dirname(self.db_path)
-            if parent_dir and not os.path.exists(parent_dir):
-                os.makedirs(parent_dir, exist_ok=True)
-
-            self.conn = sqlite3.connect(self.db_path)
-            # SQLite row_factory allows dictionary-style access with row['column_name']
-            self.conn.row_factory = sqlite3.Row
-        return self.conn
+    """SQLite connection manager with a single writer and a pool of readers
+
+    WAL mode lets any number of readers run alongside one writer, so reads
+    check out a pooled connection while writes share one connection behind a
+    lock. Connections run in autocommit mode; multi-statement writes go
+    through ``transaction()``.
+    """
+
+    def __init__(self, db_path: str = None, pool_size: int = _READER_POOL_SIZE):
+        self.db_path = db_path or config.database_path
+        self.pool_size = pool_size
+        self._readers: "queue.LifoQueue[sqlite3.Connection]" = queue.LifoQueue()
+        self._reader_count = 0
+        self._pool_lock = threading.Lock()
+        self._writer: Optional[sqlite3.Connection] = None
+        self._writer_lock = threading.Lock()
+        # Single-statement writes from the request path go through here
+        self.writes = WriteBatcher(self)
+
+    def _connect(self) -> sqlite3.Connection:
+        """Open a new connection with the shared settings applied"""
+        # Ensure parent directory exists
+        parent_dir = os.path.dirname(self.db_path)
+        if parent_dir and not os.path.exists(parent_dir):
+            os.makedirs(parent_dir, exist_ok=True)
+
+        conn = sqlite3.connect(
+            self.db_path,
+            # Timestamps are stored as epoch numbers and converted by the
+            # models, so sqlite3's declared-type converters stay off
+            detect_types=0,
+            cached_statements=_STATEMENT_CACHE_SIZE,
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        for pragma in _CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        # SQLite row_factory allows dictionary-style access with row['column_name']
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _checkout_reader(self) -> sqlite3.Connection:
+        """Take an idle reader, opening a new one while under the pool size"""
+        try:
+            return self._readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self._pool_lock:
+            can_open = self._reader_count < self.pool_size
+            if can_open:
+                self._reader_count += 1
+        if can_open:
+            return self._connect()
+        return self._readers.get()
+
+    @contextmanager
+    def connection(self, write: bool = False) -> Iterator[sqlite3.Connection]:
+        """Borrow a connection, the shared writer if ``write`` else a reader"""
+        if write:
+            with self._writer_lock:
+                if self._writer is None:
+                    self._writer = self._connect()
+                yield self._writer
+            return
+
+        conn = self._checkout_reader()
+        try:
+            yield conn
+        finally:
+            self._readers.put(conn)
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Cursor]:
+        """Run statements on the writer inside one IMMEDIATE transaction"""
+        with self.connection(write=True) as conn:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                yield cursor
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
 
     def close(self):
-        """Close the database connection"""
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        """Close the writer and every idle reader connection"""
+        with self._writer_lock:
+            if self._writer is not None:
+                self._writer.close()
+                self._writer = None
+        while True:
+            try:
+                conn = self._readers.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._pool_lock:
+                self._reader_count -= 1
+
+    async def ensure_schema(self) -> None:
+        """Create and migrate the schema off the event loop"""
+        await run_in_thread(self.create_tables)
 
     def create_tables(self):
         """Create database tables if they don't exist"""
-        conn = self.get_connection()
-        cursor = conn.cursor()
+        with self.connection(write=True) as conn:
+            self._create_tables(conn.cursor())
+
+    def _create_tables(self, cursor: sqlite3.Cursor) -> None:
+        """Create the schema on the writer and bring it up to date"""
+        # A brand new database gets the current schema and needs no migrations
+        cursor.execute("SELECT COUNT(*) FROM sqlite_master")
+        is_new = cursor.fetchone()[0] == 0
 
         # Users table
         cursor.execute(
@@ -47,8 +441,8 @@ class Database:
 		CREATE TABLE IF NOT EXISTS users (
 			phone_number TEXT PRIMARY KEY,
 			name TEXT,
-			created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-			last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+			created_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			last_interaction REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
 			active_conversation_id TEXT
 		)
 		"""
@@ -62,8 +456,8 @@ class Database:
 			user_id TEXT,
 			context TEXT,
 			active_product_id TEXT,
-			created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-			updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+			created_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			updated_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
 			FOREIGN KEY (user_id) REFERENCES users (phone_number)
 		)
 		"""
@@ -81,9 +475,9 @@ class Database:
 			media_url TEXT,
 			message_type TEXT DEFAULT 'text',
 			platform TEXT DEFAULT 'whatsapp',
-			metadata TEXT,
-			raw_data TEXT,
-			timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+			metadata BLOB,
+			raw_data BLOB,
+			timestamp REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
 			FOREIGN KEY (conversation_id) REFERENCES conversations (id)
 		)
 		"""
@@ -103,6 +497,19 @@ class Database:
 		"""
         )
 
+        # Full-text index over product names and descriptions for search. It
+        # keeps its own copy of the text, keyed by product_id, because the
+        # implicit rowid of products is not stable across VACUUM.
+        cursor.execute(
+            """
+		CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+			product_id UNINDEXED,
+			name,
+			description
+		)
+		"""
+        )
+
         # Product Categories table
         cursor.execute(
             """
@@ -111,7 +518,7 @@ class Database:
 			category TEXT,
 			PRIMARY KEY (product_id, category),
 			FOREIGN KEY (product_id) REFERENCES products (id)
-		)
+		) WITHOUT ROWID
 		"""
         )
 
@@ -137,8 +544,8 @@ class Database:
 			user_id TEXT,
 			total_amount REAL,
 			status TEXT,
-			created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-			updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+			created_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
+			updated_at REAL DEFAULT ((julianday('now') - 2440587.5) * 86400.0),
 			FOREIGN KEY (user_id) REFERENCES users (phone_number)
 		)
 		"""
@@ -176,8 +583,99 @@ class Database:
 		"""
         )
 
-        conn.commit()
+        # Migrations may rebuild tables, dropping their indexes and triggers,
+        # so those are created once the tables are up to date
+        if is_new:
+            cursor.execute(f"PRAGMA user_version = {len(_MIGRATIONS)}")
+        else:
+            self._migrate(cursor)
+
+        # Indexes on the foreign keys the models filter and sort by
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_msg_conv_ts ON messages (conversation_id, timestamp DESC)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_orders_user_ts ON orders (user_id, created_at DESC)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_order_items_order ON order_items (order_id)"
+        )
+        cursor.execute(
+            "CREATE INDEX IF NOT EXISTS idx_cart_conv_product ON cart_items (conversation_id, product_id)"
+        )
+
+        # Keep products_fts in sync with products
+        cursor.execute(
+            """
+		CREATE TRIGGER IF NOT EXISTS trg_products_fts_insert AFTER INSERT ON products
+		BEGIN
+			INSERT INTO products_fts (product_id, name, description)
+			VALUES (NEW.id, NEW.name, NEW.description);
+		END
+		"""
+        )
+        cursor.execute(
+            """
+		CREATE TRIGGER IF NOT EXISTS trg_products_fts_update
+		AFTER UPDATE OF id, name, description ON products
+		BEGIN
+			UPDATE products_fts
+			SET product_id = NEW.id, name = NEW.name, description = NEW.description
+			WHERE product_id = OLD.id;
+		END
+		"""
+        )
+        cursor.execute(
+            """
+		CREATE TRIGGER IF NOT EXISTS trg_products_fts_delete AFTER DELETE ON products
+		BEGIN
+			DELETE FROM products_fts WHERE product_id = OLD.id;
+		END
+		"""
+        )
+
+        # Keep a conversation's updated_at in step with its newest message as
+        # part of the INSERT itself
+        cursor.execute(
+            """
+		CREATE TRIGGER IF NOT EXISTS trg_msg_touch_conv AFTER INSERT ON messages
+		BEGIN
+			UPDATE conversations SET updated_at = NEW.timestamp
+			WHERE id = NEW.conversation_id;
+		END
+		"""
+        )
+
+    def _migrate(self, cursor: sqlite3.Cursor) -> None:
+        """Apply pending migrations, each in its own transaction"""
+        version = cursor.execute("PRAGMA user_version").fetchone()[0]
+        for target, statements in enumerate(_MIGRATIONS, start=1):
+            if version >= target:
+                continue
+            cursor.execute("BEGIN")
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+                cursor.execute(f"PRAGMA user_version = {target}")
+            except sqlite3.Error:
+                cursor.execute("ROLLBACK")
+                raise
+            cursor.execute("COMMIT")
+
+
+_database: Optional[Database] = None
+_database_lock = threading.Lock()
+
 
+def get_database() -> Database:
+    """Return the shared Database, creating it on first use
 
-# Initialize the database
-database = Database()
+    Creating it opens no connection; call ensure_schema() once at startup
+    before serving requests.
+    """
+    global _database
+    if _database is None:
+        with _database_lock:
+            if _database is None:
+                _database = Database()
+    return _database
@@ -1,14 +1,59 @@
-import uuid
+import sqlite3
+import time
 from datetime import datetime
-from typing import Optional, Dict, Any, List, Union
+from typing import Optional, Dict, Any, List, Tuple, Union
 
-from app.models.database import database
+import orjson
+
+from app.models.database import get_database, new_id, run_in_thread
 from app.models.conversation import Conversation
 
+# Module-level SQL so each call reuses the same statement-cache entry
+_INSERT_SQL = """
+	INSERT INTO messages
+	(id, conversation_id, role, content, phone_number, media_url, message_type,
+	 platform, metadata, raw_data, timestamp)
+	VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+	"""
+_GET_BY_ID_SQL = "SELECT * FROM messages WHERE id = ?"
+# The newest messages of a conversation, returned oldest first
+# Columns are listed in Message.__init__ argument order so the history query
+# can use plain tuple rows; see _from_tuple
+_RECENT_FOR_CONVERSATION_SQL = """
+	SELECT id, conversation_id, role, content, phone_number, media_url,
+		message_type, platform, metadata, raw_data, timestamp
+	FROM (
+		SELECT * FROM messages WHERE conversation_id = ?
+		ORDER BY timestamp DESC, id DESC LIMIT ?
+	) ORDER BY timestamp, id
+	"""
+
+# Rows pulled from SQLite per fetchmany() call when reading history
+_FETCH_BATCH_SIZE = 64
+
+
+def _load_json(value: Optional[Union[bytes, str]]) -> Dict[str, Any]:
+    """Decode a stored metadata/raw_data column, treating NULL as empty"""
+    return orjson.loads(value) if value else {}
+
 
 class Message:
     """Message model representing a single message in a conversation"""
 
+    __slots__ = (
+        "id",
+        "conversation_id",
+        "role",
+        "content",
+        "phone_number",
+        "media_url",
+        "message_type",
+        "platform",
+        "metadata",
+        "raw_data",
+        "_ts_raw",
+    )
+
     def __init__(
         self,
         id: str,
@@ -21,7 +66,7 @@ class Message:
         platform: str = "whatsapp",
         metadata: Optional[Dict[str, Any]] = None,
         raw_data: Optional[Dict[str, Any]] = None,
-        timestamp: Optional[datetime] = None,
+        timestamp: Optional[Union[datetime, float]] = None,
     ):
         self.id = id
         self.conversation_id = conversation_id
@@ -33,10 +78,19 @@ class Message:
         self.platform = platform
         self.metadata = metadata or {}
         self.raw_data = raw_data or {}
-        self.timestamp = timestamp or datetime.now()
+        # Epoch seconds as stored; converted to a datetime on first access
+        self._ts_raw = timestamp or time.time()
+
+    @property
+    def timestamp(self) -> datetime:
+        """When the message was created"""
+        value = self._ts_raw
+        if not isinstance(value, datetime):
+            value = self._ts_raw = datetime.fromtimestamp(value)
+        return value
 
     @classmethod
-    async def create(
+    def new(
         cls,
         conversation_id: str,
         role: str,
@@ -48,45 +102,9 @@ class Message:
         metadata: Optional[Dict[str, Any]] = None,
         raw_data: Optional[Dict[str, Any]] = None,
     ) -> "Message":
-        """Create a new message"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
-
-        message_id = str(uuid.uuid4())
-        now = datetime.now().isoformat()
-        metadata_json = json.dumps(metadata or {})
-        raw_data_json = json.dumps(raw_data or {})
-
-        cursor.execute(
-            """INSERT INTO messages 
-			   (id, conversation_id, role, content, phone_number, media_url, message_type, 
-				platform, metadata, raw_data, timestamp)
-			   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-            (
-                message_id,
-                conversation_id,
-                role,
-                content,
-                phone_number,
-                media_url,
-                message_type,
-                platform,
-                metadata_json,
-                raw_data_json,
-                now,
-            ),
-        )
-
-        # Update conversation last updated time
-        cursor.execute(
-            "UPDATE conversations SET updated_at = ? WHERE id = ?",
-            (now, conversation_id),
-        )
-
-        conn.commit()
-
+        """Build a new message with a fresh ID and timestamp, without saving it"""
         return Message(
-            id=message_id,
+            id=new_id(),
             conversation_id=conversation_id,
             role=role,
             content=content,
@@ -94,92 +112,159 @@ class Message:
             media_url=media_url,
             message_type=message_type,
             platform=platform,
-            metadata=metadata or {},
-            raw_data=raw_data or {},
-            timestamp=datetime.fromisoformat(now),
+            metadata=metadata,
+            raw_data=raw_data,
+            timestamp=time.time(),
         )
 
     @classmethod
-    async def get_by_id(cls, message_id: str) -> Optional["Message"]:
-        """Get a message by ID"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+    async def create(
+        cls,
+        conversation_id: str,
+        role: str,
+        content: str,
+        phone_number: Optional[str] = None,
+        media_url: Optional[str] = None,
+        message_type: str = "text",
+        platform: str = "whatsapp",
+        metadata: Optional[Dict[str, Any]] = None,
+        raw_data: Optional[Dict[str, Any]] = None,
+    ) -> "Message":
+        """Create a new message"""
+        message = cls.new(
+            conversation_id,
+            role,
+            content,
+            phone_number=phone_number,
+            media_url=media_url,
+            message_type=message_type,
+            platform=platform,
+            metadata=metadata,
+            raw_data=raw_data,
+        )
 
-        cursor.execute("SELECT * FROM messages WHERE id = ?", (message_id,))
+        # trg_msg_touch_conv bumps the conversation's updated_at in the same write
+        await get_database().writes.execute(_INSERT_SQL, message._insert_params())
 
-        message_data = cursor.fetchone()
-        if not message_data:
-            return None
+        return message
 
-        metadata = {}
-        raw_data = {}
+    @classmethod
+    async def create_many(cls, messages: List["Message"]) -> None:
+        """Save messages built with new() in one transaction, in list order"""
+        await run_in_thread(cls._create_many_sync, messages)
 
-        try:
-            if 'metadata' in message_data and message_data['metadata']:
-                metadata = json.loads(message_data['metadata'])
-            if 'raw_data' in message_data and message_data['raw_data']:
-                raw_data = json.loads(message_data['raw_data'])
-        except json.JSONDecodeError:
-            pass
+    @classmethod
+    def _create_many_sync(cls, messages: List["Message"]) -> None:
+        with get_database().transaction() as cursor:
+            cursor.executemany(
+                _INSERT_SQL, [message._insert_params() for message in messages]
+            )
 
-        return Message(
-            id=message_data['id'],
-            conversation_id=message_data['conversation_id'],
-            role=message_data['role'],
-            content=message_data['content'],
-            phone_number=message_data['phone_number'] if 'phone_number' in message_data else None,
-            media_url=message_data['media_url'] if 'media_url' in message_data else None,
-            message_type=message_data['message_type'] if 'message_type' in message_data else 'text',
-            platform=message_data['platform'] if 'platform' in message_data else 'whatsapp',
-            metadata=metadata,
-            raw_data=raw_data,
-            timestamp=datetime.fromisoformat(message_data['timestamp']),
+    def _insert_params(self) -> Tuple[Any, ...]:
+        """Parameters for _INSERT_SQL, in column order"""
+        timestamp = self._ts_raw
+        if isinstance(timestamp, datetime):
+            timestamp = timestamp.timestamp()
+        # orjson encodes straight to bytes, which are stored as BLOBs
+        return (
+            self.id,
+            self.conversation_id,
+            self.role,
+            self.content,
+            self.phone_number,
+            self.media_url,
+            self.message_type,
+            self.platform,
+            orjson.dumps(self.metadata),
+            orjson.dumps(self.raw_data),
+            timestamp,
         )
 
+    @classmethod
+    async def get_by_id(cls, message_id: str) -> Optional["Message"]:
+        """Get a message by ID"""
+        return await run_in_thread(cls._get_by_id_sync, message_id)
+
+    @classmethod
+    def _get_by_id_sync(cls, message_id: str) -> Optional["Message"]:
+        with get_database().connection() as conn:
+            message_data = conn.execute(_GET_BY_ID_SQL, (message_id,)).fetchone()
+        if not message_data:
+            return None
+
+        return cls.from_row(message_data)
+
     @classmethod
     async def get_messages_for_conversation(
         cls, conversation_id: str, limit: int = 10
     ) -> List["Message"]:
         """Get recent messages from a conversation"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "SELECT * FROM messages WHERE conversation_id = ? ORDER BY timestamp DESC LIMIT ?",
-            (conversation_id, limit),
+        return await run_in_thread(
+            cls._get_messages_for_conversation_sync, conversation_id, limit
         )
 
-        messages = []
-        for row in cursor.fetchall():
-            metadata = {}
-            raw_data = {}
-
-            try:
-                if 'metadata' in row and row['metadata']:
-                    metadata = json.loads(row['metadata'])
-                if 'raw_data' in row and row['raw_data']:
-                    raw_data = json.loads(row['raw_data'])
-            except json.JSONDecodeError:
-                pass
-
-            messages.append(
-                Message(
-                    id=row['id'],
-                    conversation_id=row['conversation_id'],
-                    role=row['role'],
-                    content=row['content'],
-                    phone_number=row['phone_number'] if 'phone_number' in row else None,
-                    media_url=row['media_url'] if 'media_url' in row else None,
-                    message_type=row['message_type'] if 'message_type' in row else 'text',
-                    platform=row['platform'] if 'platform' in row else 'whatsapp',
-                    metadata=metadata,
-                    raw_data=raw_data,
-                    timestamp=datetime.fromisoformat(row['timestamp']),
-                )
-            )
+    @classmethod
+    def _get_messages_for_conversation_sync(
+        cls, conversation_id: str, limit: int = 10
+    ) -> List["Message"]:
+        with get_database().connection() as conn:
+            # Plain tuples skip building an sqlite3.Row for every message
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            cursor.arraysize = _FETCH_BATCH_SIZE
+            cursor.execute(_RECENT_FOR_CONVERSATION_SQL, (conversation_id, limit))
+            return [
+                cls._from_tuple(row)
+                for batch in iter(cursor.fetchmany, [])
+                for row in batch
+            ]
 
-        # Return messages in chronological order
-        return list(reversed(messages))
+    @classmethod
+    def _from_tuple(cls, row: Tuple[Any, ...]) -> "Message":
+        """Build a message from a _RECENT_FOR_CONVERSATION_SQL tuple row"""
+        (
+            message_id,
+            conversation_id,
+            role,
+            content,
+            phone_number,
+            media_url,
+            message_type,
+            platform,
+            metadata,
+            raw_data,
+            timestamp,
+        ) = row
+        return Message(
+            message_id,
+            conversation_id,
+            role,
+            content,
+            phone_number,
+            media_url,
+            message_type,
+            platform,
+            _load_json(metadata),
+            _load_json(raw_data),
+            timestamp,
+        )
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Message":
+        """Build a message from a messages row"""
+        return Message(
+            id=row['id'],
+            conversation_id=row['conversation_id'],
+            role=row['role'],
+            content=row['content'],
+            phone_number=row['phone_number'],
+            media_url=row['media_url'],
+            message_type=row['message_type'],
+            platform=row['platform'],
+            metadata=_load_json(row['metadata']),
+            raw_data=_load_json(row['raw_data']),
+            timestamp=row['timestamp'],
+        )
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert message to dictionary"""
@@ -212,6 +297,3 @@ class Message:
             metadata={"message_id": data.get("message_id")},
             raw_data=data.get("raw_data", {}),
         )
-
-
-import json  # Needed for JSON serialization/deserialization
@@ -1,15 +1,39 @@
-import uuid
 from datetime import datetime
 from typing import Optional, Dict, Any, List
 
-from app.models.database import database
+from app.models.database import get_database, new_id, run_in_thread
 from app.models.cart import Cart, CartItem
 from app.models.product import Product
 
+# Module-level SQL so each call reuses the same statement-cache entry
+_INSERT_ORDER_SQL = (
+    "INSERT INTO orders (id, user_id, total_amount, status, created_at, updated_at)"
+    " VALUES (?, ?, ?, ?, ?, ?)"
+)
+_INSERT_ITEM_SQL = (
+    "INSERT INTO order_items (id, order_id, product_id, quantity, unit_price)"
+    " VALUES (?, ?, ?, ?, ?)"
+)
+_GET_BY_ID_SQL = "SELECT * FROM orders WHERE id = ?"
+_ITEMS_FOR_ORDER_SQL = "SELECT * FROM order_items WHERE order_id = ?"
+# A user's latest orders joined to their items; the LIMIT applies to orders.
+# Columns are fixed so the rows can be read as plain tuples.
+_RECENT_FOR_USER_SQL = """
+	SELECT o.id, o.user_id, o.total_amount, o.status, o.created_at, o.updated_at,
+		oi.id, oi.product_id, oi.quantity, oi.unit_price
+	FROM (
+		SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC LIMIT ?
+	) o
+	LEFT JOIN order_items oi ON oi.order_id = o.id
+	ORDER BY o.created_at DESC, o.id
+	"""
+
 
 class OrderItem:
     """Order item model representing a product in an order"""
 
+    __slots__ = ("id", "order_id", "product_id", "quantity", "unit_price", "product")
+
     def __init__(
         self, id: str, order_id: str, product_id: str, quantity: int, unit_price: float
     ):
@@ -18,7 +42,7 @@ class OrderItem:
         self.product_id = product_id
         self.quantity = quantity
         self.unit_price = unit_price
-        self.product = None  # Populated on demand
+        self.product: Optional[Product] = None  # Populated on demand
 
     async def get_product(self) -> Optional[Product]:
         """Load the associated product"""
@@ -45,6 +69,17 @@ class OrderItem:
 class Order:
     """Order model representing a completed purchase"""
 
+    __slots__ = (
+        "id",
+        "user_id",
+        "total_amount",
+        "status",
+        "created_at",
+        "updated_at",
+        "items",
+        "payment",
+    )
+
     def __init__(
         self,
         id: str,
@@ -68,44 +103,28 @@ class Order:
         cls, user_id: str, conversation_id: str
     ) -> Optional["Order"]:
         """Create a new order from a cart"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(
+            cls._create_from_cart_sync, user_id, conversation_id
+        )
 
-        # Get cart items
-        cart_items = await Cart.get_items(conversation_id)
+    @classmethod
+    def _create_from_cart_sync(
+        cls, user_id: str, conversation_id: str
+    ) -> Optional["Order"]:
+        # Get cart items and their total
+        cart_items, total_amount = Cart._get_items_with_total_sync(conversation_id)
         if not cart_items:
             return None
 
-        # Calculate total
-        total_amount = await Cart.calculate_total(conversation_id)
-
-        # Create order
-        order_id = str(uuid.uuid4())
-        now = datetime.now().isoformat()
-
-        cursor.execute(
-            "INSERT INTO orders (id, user_id, total_amount, status, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
-            (order_id, user_id, total_amount, "pending", now, now),
-        )
+        order_id = new_id()
+        now = datetime.now()
+        timestamp = now.timestamp()
 
-        # Create order items
         order_items = []
         for cart_item in cart_items:
             if cart_item.product:
-                item_id = str(uuid.uuid4())
-                cursor.execute(
-                    "INSERT INTO order_items (id, order_id, product_id, quantity, unit_price) VALUES (?, ?, ?, ?, ?)",
-                    (
-                        item_id,
-                        order_id,
-                        cart_item.product_id,
-                        cart_item.quantity,
-                        cart_item.product.price,
-                    ),
-                )
-
                 order_item = OrderItem(
-                    id=item_id,
+                    id=new_id(),
                     order_id=order_id,
                     product_id=cart_item.product_id,
                     quantity=cart_item.quantity,
@@ -114,10 +133,22 @@ class Order:
                 order_item.product = cart_item.product
                 order_items.append(order_item)
 
-        # Clear the cart
-        await Cart.clear(conversation_id)
+        # Write the order, its items and the cart cleanup as one transaction
+        with get_database().transaction() as cursor:
+            cursor.execute(
+                _INSERT_ORDER_SQL,
+                (order_id, user_id, total_amount, "pending", timestamp, timestamp),
+            )
+
+            cursor.executemany(
+                _INSERT_ITEM_SQL,
+                [
+                    (item.id, order_id, item.product_id, item.quantity, item.unit_price)
+                    for item in order_items
+                ],
+            )
 
-        conn.commit()
+            Cart.delete_items(cursor, conversation_id)
 
         # Create and return the order
         order = Order(
@@ -125,8 +156,8 @@ class Order:
             user_id=user_id,
             total_amount=total_amount,
             status="pending",
-            created_at=datetime.fromisoformat(now),
-            updated_at=datetime.fromisoformat(now),
+            created_at=now,
+            updated_at=now,
         )
         order.items = order_items
 
@@ -135,14 +166,22 @@ class Order:
     @classmethod
     async def get_by_id(cls, order_id: str) -> Optional["Order"]:
         """Get an order by ID"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(cls._get_by_id_sync, order_id)
 
-        cursor.execute("SELECT * FROM orders WHERE id = ?", (order_id,))
+    @classmethod
+    def _get_by_id_sync(cls, order_id: str) -> Optional["Order"]:
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
 
-        order_data = cursor.fetchone()
-        if not order_data:
-            return None
+            cursor.execute(_GET_BY_ID_SQL, (order_id,))
+
+            order_data = cursor.fetchone()
+            if not order_data:
+                return None
+
+            # Get order items
+            cursor.execute(_ITEMS_FOR_ORDER_SQL, (order_id,))
+            item_rows = cursor.fetchall()
 
         # Create order
         order = Order(
@@ -150,25 +189,25 @@ class Order:
             user_id=order_data['user_id'],
             total_amount=order_data['total_amount'],
             status=order_data['status'],
-            created_at=datetime.fromisoformat(order_data['created_at']),
-            updated_at=datetime.fromisoformat(order_data['updated_at']),
+            created_at=datetime.fromtimestamp(order_data['created_at']),
+            updated_at=datetime.fromtimestamp(order_data['updated_at']),
         )
 
-        # Get order items
-        cursor.execute("SELECT * FROM order_items WHERE order_id = ?", (order_id,))
-
-        items = []
-        for row in cursor.fetchall():
-            item = OrderItem(
+        items = [
+            OrderItem(
                 id=row['id'],
                 order_id=order_id,
                 product_id=row['product_id'],
                 quantity=row['quantity'],
                 unit_price=row['unit_price'],
             )
-            # Load the product
-            await item.get_product()
-            items.append(item)
+            for row in item_rows
+        ]
+
+        # Load every referenced product in one query
+        products = Product._get_many_sync(item.product_id for item in items)
+        for item in items:
+            item.product = products.get(item.product_id)
 
         order.items = items
 
@@ -180,58 +219,66 @@ class Order:
     @classmethod
     async def get_by_user(cls, user_id: str, limit: int = 10) -> List["Order"]:
         """Get orders for a user"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
-
-        cursor.execute(
-            "SELECT * FROM orders WHERE user_id = ? ORDER BY created_at DESC LIMIT ?",
-            (user_id, limit),
-        )
+        return await run_in_thread(cls._get_by_user_sync, user_id, limit)
 
-        orders = []
-        for row in cursor.fetchall():
-            order = Order(
-                id=row['id'],
-                user_id=row['user_id'],
-                total_amount=row['total_amount'],
-                status=row['status'],
-                created_at=datetime.fromisoformat(row['created_at']),
-                updated_at=datetime.fromisoformat(row['updated_at']),
-            )
-            # Load order items
-            cursor.execute("SELECT * FROM order_items WHERE order_id = ?", (order.id,))
-
-            items = []
-            for item_row in cursor.fetchall():
-                item = OrderItem(
-                    id=item_row['id'],
-                    order_id=order.id,
-                    product_id=item_row['product_id'],
-                    quantity=item_row['quantity'],
-                    unit_price=item_row['unit_price'],
+    @classmethod
+    def _get_by_user_sync(cls, user_id: str, limit: int = 10) -> List["Order"]:
+        with get_database().connection() as conn:
+            # Plain tuples skip building an sqlite3.Row per order item
+            cursor = conn.cursor()
+            cursor.row_factory = None
+            rows = cursor.execute(_RECENT_FOR_USER_SQL, (user_id, limit)).fetchall()
+
+        # Rows arrive grouped by order, newest first, one per item
+        orders_by_id: Dict[str, Order] = {}
+        for (
+            order_id,
+            order_user_id,
+            total_amount,
+            status,
+            created_at,
+            updated_at,
+            item_id,
+            product_id,
+            quantity,
+            unit_price,
+        ) in rows:
+            order = orders_by_id.get(order_id)
+            if order is None:
+                order = orders_by_id[order_id] = Order(
+                    id=order_id,
+                    user_id=order_user_id,
+                    total_amount=total_amount,
+                    status=status,
+                    created_at=datetime.fromtimestamp(created_at),
+                    updated_at=datetime.fromtimestamp(updated_at),
+                )
+            if item_id is not None:
+                order.items.append(
+                    OrderItem(
+                        id=item_id,
+                        order_id=order_id,
+                        product_id=product_id,
+                        quantity=quantity,
+                        unit_price=unit_price,
+                    )
                 )
-                items.append(item)
-
-            order.items = items
-            orders.append(order)
 
-        return orders
+        return list(orders_by_id.values())
 
     async def update_status(self, status: str) -> None:
         """Update the order status"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        await run_in_thread(self._update_status_sync, status)
 
-        now = datetime.now().isoformat()
+    def _update_status_sync(self, status: str) -> None:
         self.status = status
-        self.updated_at = datetime.fromisoformat(now)
-
-        cursor.execute(
-            "UPDATE orders SET status = ?, updated_at = ? WHERE id = ?",
-            (status, now, self.id),
-        )
+        self.updated_at = datetime.now()
 
-        conn.commit()
+        with get_database().connection(write=True) as conn:
+            conn.execute(
+                "UPDATE orders SET status = ?, updated_at = ? WHERE id = ?",
+                (status, self.updated_at.timestamp(), self.id),
+            )
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert order to dictionary"""
@@ -1,13 +1,105 @@
-import uuid
-from typing import Optional, Dict, Any, List
+import re
+import sqlite3
+from typing import Optional, Dict, Any, Iterable, List
 from datetime import datetime
 
-from app.models.database import database
+from app.models.database import get_database, new_id, run_in_thread
+
+# Separator for categories aggregated with GROUP_CONCAT(category, char(31))
+CATEGORY_SEPARATOR = "\x1f"
+
+
+def split_categories(value: Optional[str]) -> List[str]:
+    """Split a GROUP_CONCAT-ed category list back into a list"""
+    return value.split(CATEGORY_SEPARATOR) if value else []
+
+
+# Hot queries are module constants so every call passes sqlite3 the same
+# SQL text and hits its per-connection statement cache. Categories are
+# aggregated in the same query rather than fetched per row.
+_SEARCH_ALL_SQL = """
+	SELECT p.*,
+		(SELECT GROUP_CONCAT(pc.category, char(31)) FROM product_categories pc
+		 WHERE pc.product_id = p.id) AS categories
+	FROM products_fts f
+	JOIN products p ON p.id = f.product_id
+	WHERE products_fts MATCH :q
+	ORDER BY f.rank
+	LIMIT :lim
+	"""
+
+_SEARCH_CATEGORY_SQL = """
+	SELECT p.*,
+		(SELECT GROUP_CONCAT(pc.category, char(31)) FROM product_categories pc
+		 WHERE pc.product_id = p.id) AS categories
+	FROM products_fts f
+	JOIN products p ON p.id = f.product_id
+	WHERE products_fts MATCH :q
+	AND EXISTS (
+		SELECT 1 FROM product_categories c
+		WHERE c.product_id = p.id AND c.category = :cat
+	)
+	ORDER BY f.rank
+	LIMIT :lim
+	"""
+
+# A query with no searchable words lists products, as LIKE '%%' used to
+_LIST_ALL_SQL = """
+	SELECT p.*, GROUP_CONCAT(pc.category, char(31)) AS categories
+	FROM products p
+	LEFT JOIN product_categories pc ON pc.product_id = p.id
+	GROUP BY p.id
+	LIMIT :lim
+	"""
+
+_LIST_CATEGORY_SQL = """
+	SELECT p.*, GROUP_CONCAT(pc.category, char(31)) AS categories
+	FROM products p
+	LEFT JOIN product_categories pc ON pc.product_id = p.id
+	WHERE EXISTS (
+		SELECT 1 FROM product_categories c
+		WHERE c.product_id = p.id AND c.category = :cat
+	)
+	GROUP BY p.id
+	LIMIT :lim
+	"""
+
+_SEARCH_TOKEN = re.compile(r"\w+")
+
+
+def _match_expression(query: str) -> str:
+    """Turn free text into an FTS5 query matching every word as a prefix
+
+    Each word is quoted so FTS5 operators and punctuation in user input are
+    never interpreted as query syntax.
+    """
+    return " ".join(f'"{token}"*' for token in _SEARCH_TOKEN.findall(query))
+
+
+_GET_BY_ID_SQL = "SELECT * FROM products WHERE id = ?"
+_GET_MANY_SQL = """
+	SELECT p.*, GROUP_CONCAT(pc.category, char(31)) AS categories
+	FROM products p
+	LEFT JOIN product_categories pc ON pc.product_id = p.id
+	WHERE p.id IN ({placeholders})
+	GROUP BY p.id
+	"""
+_GET_CATEGORIES_SQL = "SELECT category FROM product_categories WHERE product_id = ?"
 
 
 class Product:
     """Product model representing an item for sale"""
 
+    __slots__ = (
+        "id",
+        "name",
+        "description",
+        "price",
+        "image_url",
+        "in_stock",
+        "categories",
+    )
+
     def __init__(
         self,
         id: str,
@@ -36,26 +128,34 @@ class Product:
         categories: Optional[List[str]] = None,
     ) -> "Product":
         """Create a new product"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(
+            cls._create_sync, name, description, price, image_url, categories
+        )
 
-        product_id = str(uuid.uuid4())
+    @classmethod
+    def _create_sync(
+        cls,
+        name: str,
+        description: str,
+        price: float,
+        image_url: Optional[str] = None,
+        categories: Optional[List[str]] = None,
+    ) -> "Product":
+        product_id = new_id()
 
-        cursor.execute(
-            "INSERT INTO products (id, name, description, price, image_url, in_stock) VALUES (?, ?, ?, ?, ?, ?)",
-            (product_id, name, description, price, image_url, True),
-        )
+        with get_database().transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO products (id, name, description, price, image_url, in_stock) VALUES (?, ?, ?, ?, ?, ?)",
+                (product_id, name, description, price, image_url, True),
+            )
 
-        # Add categories if provided
-        if categories:
-            for category in categories:
-                cursor.execute(
+            # Add categories if provided
+            if categories:
+                cursor.executemany(
                     "INSERT INTO product_categories (product_id, category) VALUES (?, ?)",
-                    (product_id, category),
+                    [(product_id, category) for category in categories],
                 )
 
-        conn.commit()
-
         return Product(
             id=product_id,
             name=name,
@@ -69,22 +169,23 @@ class Product:
     @classmethod
     async def get_by_id(cls, product_id: str) -> Optional["Product"]:
         """Get a product by ID"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(cls._get_by_id_sync, product_id)
 
-        cursor.execute("SELECT * FROM products WHERE id = ?", (product_id,))
+    @classmethod
+    def _get_by_id_sync(cls, product_id: str) -> Optional["Product"]:
+        with get_database().connection() as conn:
+            cursor = conn.cursor()
 
-        product_data = cursor.fetchone()
-        if not product_data:
-            return None
+            cursor.execute(_GET_BY_ID_SQL, (product_id,))
 
-        # Get categories
-        cursor.execute(
-            "SELECT category FROM product_categories WHERE product_id = ?",
-            (product_id,),
-        )
+            product_data = cursor.fetchone()
+            if not product_data:
+                return None
 
-        categories = [row['category'] for row in cursor.fetchall()]
+            # Get categories
+            cursor.execute(_GET_CATEGORIES_SQL, (product_id,))
+
+            categories = [row['category'] for row in cursor.fetchall()]
 
         return Product(
             id=product_data['id'],
@@ -96,58 +197,59 @@ class Product:
             categories=categories,
         )
 
+    @classmethod
+    async def get_many(cls, product_ids: Iterable[str]) -> Dict[str, "Product"]:
+        """Get several products by ID in one query, keyed by ID"""
+        return await run_in_thread(cls._get_many_sync, product_ids)
+
+    @classmethod
+    def _get_many_sync(cls, product_ids: Iterable[str]) -> Dict[str, "Product"]:
+        ids = tuple(set(product_ids))
+        if not ids:
+            return {}
+
+        sql = _GET_MANY_SQL.format(placeholders=",".join("?" * len(ids)))
+        with get_database().connection() as conn:
+            rows = conn.execute(sql, ids).fetchall()
+
+        return {row['id']: cls.from_row(row) for row in rows}
+
     @classmethod
     async def search(
         cls, query: str, category: Optional[str] = None, limit: int = 10
     ) -> List["Product"]:
         """Search for products by name, description, or category"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        return await run_in_thread(cls._search_sync, query, category, limit)
 
-        if category:
-            # Search within specific category
-            cursor.execute(
-                """
-				SELECT p.* FROM products p
-				JOIN product_categories pc ON p.id = pc.product_id
-				WHERE (p.name LIKE ? OR p.description LIKE ?) AND pc.category = ?
-				LIMIT ?
-				""",
-                (f"%{query}%", f"%{query}%", category, limit),
-            )
+    @classmethod
+    def _search_sync(
+        cls, query: str, category: Optional[str] = None, limit: int = 10
+    ) -> List["Product"]:
+        match = _match_expression(query)
+        if match:
+            sql = _SEARCH_CATEGORY_SQL if category else _SEARCH_ALL_SQL
         else:
-            # Search across all products
-            cursor.execute(
-                """
-				SELECT * FROM products
-				WHERE name LIKE ? OR description LIKE ?
-				LIMIT ?
-				""",
-                (f"%{query}%", f"%{query}%", limit),
-            )
+            sql = _LIST_CATEGORY_SQL if category else _LIST_ALL_SQL
 
-        products = []
-        for row in cursor.fetchall():
-            # Get categories for this product
-            cursor.execute(
-                "SELECT category FROM product_categories WHERE product_id = ?",
-                (row['id'],),
-            )
-            categories = [cat_row['category'] for cat_row in cursor.fetchall()]
-
-            products.append(
-                Product(
-                    id=row['id'],
-                    name=row['name'],
-                    description=row['description'],
-                    price=row['price'],
-                    image_url=row['image_url'],
-                    in_stock=bool(row['in_stock']),
-                    categories=categories,
-                )
-            )
+        with get_database().connection() as conn:
+            rows = conn.execute(
+                sql, {"q": match, "cat": category, "lim": limit}
+            ).fetchall()
+
+        return [cls.from_row(row) for row in rows]
 
-        return products
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "Product":
+        """Build a product from a products row with GROUP_CONCAT-ed categories"""
+        return Product(
+            id=row['id'],
+            name=row['name'],
+            description=row['description'],
+            price=row['price'],
+            image_url=row['image_url'],
+            in_stock=bool(row['in_stock']),
+            categories=split_categories(row['categories']),
+        )
 
     def to_dict(self) -> Dict[str, Any]:
         """Convert product to dictionary"""
@@ -1,91 +1,166 @@
+import asyncio
+import sqlite3
+import time
 import uuid
 from datetime import datetime
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, List, Union
 
-from app.models.database import database
+from cachetools import TTLCache
+
+from app.models.database import get_database, run_in_thread
+
+# Recently seen users, so repeat senders are served without a database read.
+# Writes update the cached instance in place. Only touched from the event loop.
+_USER_CACHE_SIZE = 10_000
+_USER_CACHE_TTL = 60  # seconds
+_USER_CACHE: TTLCache = TTLCache(maxsize=_USER_CACHE_SIZE, ttl=_USER_CACHE_TTL)
+
+# Striped locks coalesce concurrent loads of the same phone number into one
+# query without keeping a lock per user. Each stripe is created on first use,
+# inside the running loop; before Python 3.10 an asyncio.Lock binds to the
+# event loop current when it is created.
+_LOCK_STRIPES = 256
+_user_locks: List[Optional[asyncio.Lock]] = [None] * _LOCK_STRIPES
+
+
+def _lock_for(phone_number: str) -> asyncio.Lock:
+    """Return the lock stripe guarding a phone number"""
+    stripe = hash(phone_number) % _LOCK_STRIPES
+    lock = _user_locks[stripe]
+    if lock is None:
+        lock = _user_locks[stripe] = asyncio.Lock()
+    return lock
+
+
+# Insert a new user or refresh an existing one, returning the stored row.
+# created_at is only written for new users.
+_UPSERT_SQL = """
+	INSERT INTO users (phone_number, name, created_at, last_interaction)
+	VALUES (?, ?, ?, ?)
+	ON CONFLICT (phone_number) DO UPDATE SET
+		last_interaction = excluded.last_interaction,
+		name = COALESCE(excluded.name, users.name)
+	RETURNING phone_number, name, created_at, last_interaction, active_conversation_id
+	"""
 
 
 class User:
     """User model representing a customer"""
 
+    __slots__ = (
+        "phone_number",
+        "name",
+        "active_conversation_id",
+        # Epoch seconds as stored, turned into datetimes on first access
+        "_created_raw",
+        "_last_interaction_raw",
+    )
+
     def __init__(
         self,
         phone_number: str,
         name: Optional[str] = None,
-        created_at: Optional[datetime] = None,
-        last_interaction: Optional[datetime] = None,
+        created_at: Optional[Union[datetime, float]] = None,
+        last_interaction: Optional[Union[datetime, float]] = None,
         active_conversation_id: Optional[str] = None,
     ):
         self.phone_number = phone_number
         self.name = name
-        self.created_at = created_at or datetime.now()
-        self.last_interaction = last_interaction or datetime.now()
         self.active_conversation_id = active_conversation_id
+        self._created_raw = created_at or time.time()
+        self._last_interaction_raw = last_interaction or time.time()
+
+    @property
+    def created_at(self) -> datetime:
+        """When the user was first seen"""
+        value = self._created_raw
+        if not isinstance(value, datetime):
+            value = self._created_raw = datetime.fromtimestamp(value)
+        return value
+
+    @property
+    def last_interaction(self) -> datetime:
+        """When the user last sent a message"""
+        value = self._last_interaction_raw
+        if not isinstance(value, datetime):
+            value = self._last_interaction_raw = datetime.fromtimestamp(value)
+        return value
 
     @classmethod
     async def get_by_phone(cls, phone_number: str) -> Optional["User"]:
         """Get a user by phone number"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        user = _USER_CACHE.get(phone_number)
+        if user is not None:
+            return user
 
-        cursor.execute("SELECT * FROM users WHERE phone_number = ?", (phone_number,))
+        async with _lock_for(phone_number):
+            # Another request may have loaded the user while we waited
+            user = _USER_CACHE.get(phone_number)
+            if user is None:
+                user = await run_in_thread(cls._get_by_phone_sync, phone_number)
+                if user is not None:
+                    user = user._remember()
+        return user
 
-        user_data = cursor.fetchone()
+    @classmethod
+    def _get_by_phone_sync(cls, phone_number: str) -> Optional["User"]:
+        with get_database().connection() as conn:
+            user_data = conn.execute(
+                "SELECT * FROM users WHERE phone_number = ?", (phone_number,)
+            ).fetchone()
         if not user_data:
             return None
 
-        return User(
-            phone_number=user_data['phone_number'],
-            name=user_data['name'],
-            created_at=datetime.fromisoformat(user_data['created_at']),
-            last_interaction=datetime.fromisoformat(user_data['last_interaction']),
-            active_conversation_id=user_data['active_conversation_id'],
-        )
+        return cls.from_row(user_data)
 
     @classmethod
     async def create_or_update(
         cls, phone_number: str, name: Optional[str] = None
     ) -> "User":
         """Create a new user or update an existing one"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
-
-        user = await cls.get_by_phone(phone_number)
-        now = datetime.now().isoformat()
-
-        if user:
-            # Update existing user
-            cursor.execute(
-                "UPDATE users SET last_interaction = ?, name = COALESCE(?, name) WHERE phone_number = ?",
-                (now, name, phone_number),
-            )
-            user.last_interaction = datetime.fromisoformat(now)
-            if name:
-                user.name = name
-        else:
-            # Create new user
-            cursor.execute(
-                "INSERT INTO users (phone_number, name, last_interaction) VALUES (?, ?, ?)",
-                (phone_number, name, now),
-            )
-            user = User(
-                phone_number=phone_number,
-                name=name,
-                last_interaction=datetime.fromisoformat(now),
+        async with _lock_for(phone_number):
+            now = time.time()
+            rows = await get_database().writes.execute(
+                _UPSERT_SQL, (phone_number, name, now, now)
             )
-
-        conn.commit()
-        return user
+            return cls.from_row(rows[0])._remember()
 
     async def update_active_conversation(self, conversation_id: str) -> None:
         """Update the user's active conversation ID"""
-        conn = database.get_connection()
-        cursor = conn.cursor()
+        await run_in_thread(self._update_active_conversation_sync, conversation_id)
 
-        cursor.execute(
-            "UPDATE users SET active_conversation_id = ? WHERE phone_number = ?",
-            (conversation_id, self.phone_number),
-        )
+        cached = _USER_CACHE.get(self.phone_number)
+        if cached is not None:
+            cached.active_conversation_id = conversation_id
+
+    def _update_active_conversation_sync(self, conversation_id: str) -> None:
+        with get_database().connection(write=True) as conn:
+            conn.execute(
+                "UPDATE users SET active_conversation_id = ? WHERE phone_number = ?",
+                (conversation_id, self.phone_number),
+            )
 
         self.active_conversation_id = conversation_id
-        conn.commit()
+
+    def _remember(self) -> "User":
+        """Cache this freshly loaded user, updating any cached instance in place"""
+        cached = _USER_CACHE.get(self.phone_number)
+        if cached is None:
+            cached = self
+        else:
+            for attr in User.__slots__:
+                setattr(cached, attr, getattr(self, attr))
+        # Re-inserting also restarts the entry's TTL
+        _USER_CACHE[self.phone_number] = cached
+        return cached
+
+    @classmethod
+    def from_row(cls, row: sqlite3.Row) -> "User":
+        """Build a user from a users row"""
+        return User(
+            phone_number=row['phone_number'],
+            name=row['name'],
+            created_at=row['created_at'],
+            last_interaction=row['last_interaction'],
+            active_conversation_id=row['active_conversation_id'],
+        )
@@ -1,9 +1,31 @@
-import json
+import logging
+import re
 from abc import ABC, abstractmethod
-from typing import Dict, Any, List, Optional, Union
-from dotenv import dotenv_values
+from functools import lru_cache
+from typing import Dict, Any, AsyncGenerator, List, Optional, Tuple, Union
+
+import orjson
+from cachetools import LRUCache
+
+from app.config import config
 from app.models.tool import Tool
 
+logger = logging.getLogger(__name__)
+
+# Distinct tool lists whose API form is kept; callers reuse a handful at most
+_API_TOOLS_CACHE_SIZE = 4
+
+# A reply is sent on in pieces that end at a sentence or line boundary
+_SENTENCE_END = re.compile(r"[.!?]\s|\n")
+
+
+def _split_complete(text: str) -> Tuple[str, str]:
+    """Split text after its last sentence boundary into (complete, remainder)"""
+    end = 0
+    for match in _SENTENCE_END.finditer(text):
+        end = match.end()
+    return text[:end], text[end:]
+
 
 class LLMInterface(ABC):
     """Abstract interface for LLM providers"""
@@ -27,6 +49,21 @@ class LLMInterface(ABC):
             Dictionary with response content and updated context
         """
         pass
+
+    async def stream_response(
+        self,
+        messages: List[Dict[str, Any]],
+        context: str = "{}",
+        settings: Optional[Dict[str, Any]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Generate a response as consecutive pieces of text
+
+        Providers that cannot stream yield the whole reply at once. Joining
+        the pieces gives the full reply.
+        """
+        response = await self.generate_response(messages, context, settings)
+        yield response["content"]
     
     @abstractmethod
     async def execute_function_call(
@@ -50,36 +87,48 @@ class AnthropicClient(LLMInterface):
     
     def __init__(self):
         try:
-            from anthropic import Anthropic
-            self.anthropic = Anthropic
+            from anthropic import AsyncAnthropic
+            self.anthropic = AsyncAnthropic
         except ImportError:
             raise ImportError("Please install the anthropic package: pip install anthropic")
             
-        config = dotenv_values()
-        self.api_key = config.get("ANTHROPIC_API_KEY")
+        # Read from the environment loaded once by app.config instead of
+        # re-parsing .env on every construction
+        self.api_key = config.anthropic_api_key
         if not self.api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable not set")
         
+        # The async client keeps the event loop free during the round-trip and
+        # pools its connections across calls, since the instance is shared
         self.client = self.anthropic(api_key=self.api_key)
         self.default_model = "claude-3-sonnet-20240229"
         self.default_max_tokens = 1000
+        # Converted tool schemas by id() of the tool list they came from. The
+        # list is kept alongside so its id cannot be reused while cached.
+        self._api_tools_cache: LRUCache = LRUCache(maxsize=_API_TOOLS_CACHE_SIZE)
     
     def _convert_messages_format(self, messages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
         """Convert our internal message format to Anthropic's expected format"""
-        anthropic_messages = []
-        
-        for msg in messages:
-            # Handle content which could be string or dict with text/attachments
-            content = msg["content"]
-            role = "assistant" if msg["role"] == "assistant" else "user"
-            
-            anthropic_messages.append({
-                "role": role,
-                "content": content
-            })
-            
-        return anthropic_messages
+        # Stored messages carry extra keys the API rejects, so only role and
+        # content are kept; any non-assistant role is sent as the user
+        return [
+            {
+                "role": "assistant" if msg["role"] == "assistant" else "user",
+                "content": msg["content"],
+            }
+            for msg in messages
+        ]
     
+    def _api_tools(self, tools: List[Tool]) -> List[Dict[str, Any]]:
+        """Return the API form of a tool list, converting each list only once"""
+        cached = self._api_tools_cache.get(id(tools))
+        if cached is not None and cached[0] is tools:
+            return cached[1]
+
+        api_tools = self._prepare_tools_for_api(tools)
+        self._api_tools_cache[id(tools)] = (tools, api_tools)
+        return api_tools
+
     def _prepare_tools_for_api(self, tools: List[Tool]) -> List[Dict[str, Any]]:
         """Convert our Tool models to the format expected by Anthropic API"""
         api_tools = []
@@ -106,6 +155,39 @@ class AnthropicClient(LLMInterface):
             
         return api_tools
 
+    def _build_params(
+        self, messages: List[Dict[str, Any]], settings: Optional[Dict[str, Any]]
+    ) -> Dict[str, Any]:
+        """Build the messages API parameters for a conversation"""
+        # Handle settings with defaults
+        settings = settings or {}
+        model = settings.get("model", self.default_model)
+        max_tokens = settings.get("max_tokens", self.default_max_tokens)
+        temperature = settings.get("temperature", 0.7)
+        system_prompt = settings.get("system_prompt", "")
+        tools = settings.get("tools", [])
+        
+        # Convert our message format to Anthropic's format
+        anthropic_messages = self._convert_messages_format(messages)
+        
+        # Prepare API call parameters
+        params = {
+            "model": model,
+            "max_tokens": max_tokens,
+            "messages": anthropic_messages,
+            "temperature": temperature,
+        }
+        
+        # Add system prompt if provided
+        if system_prompt:
+            params["system"] = system_prompt
+            
+        # Add tools if provided
+        if tools:
+            params["tools"] = self._api_tools(tools)
+
+        return params
+
     async def generate_response(
         self, 
         messages: List[Dict[str, Any]], 
@@ -131,45 +213,19 @@ class AnthropicClient(LLMInterface):
         if not messages:
             return {
                 "content": "I'm sorry, I couldn't understand your message.",
-                "updated_context": json.loads(context) if context else {},
+                "updated_context": orjson.loads(context) if context else {},
             }
         
         try:
-            context_data = json.loads(context) if context else {}
-        except json.JSONDecodeError:
+            context_data = orjson.loads(context) if context else {}
+        except orjson.JSONDecodeError:
             context_data = {}
         
-        # Handle settings with defaults
-        settings = settings or {}
-        model = settings.get("model", self.default_model)
-        max_tokens = settings.get("max_tokens", self.default_max_tokens)
-        temperature = settings.get("temperature", 0.7)
-        system_prompt = settings.get("system_prompt", "")
-        tools = settings.get("tools", [])
-        
-        # Convert our message format to Anthropic's format
-        anthropic_messages = self._convert_messages_format(messages)
-        
-        # Prepare API call parameters
-        params = {
-            "model": model,
-            "max_tokens": max_tokens,
-            "messages": anthropic_messages,
-            "temperature": temperature,
-            "stream": False,  # Streaming not supported for WhatsApp
-        }
-        
-        # Add system prompt if provided
-        if system_prompt:
-            params["system"] = system_prompt
-            
-        # Add tools if provided
-        if tools:
-            params["tools"] = self._prepare_tools_for_api(tools)
+        params = self._build_params(messages, settings)
         
         try:
             # Make the API call
-            response = self.client.messages.create(**params)
+            response = await self.client.messages.create(**params)
             
             # Extract tool calls if present
             tool_calls = []
@@ -202,14 +258,52 @@ class AnthropicClient(LLMInterface):
             }
             
         except Exception as e:
-            # Log the error in a production environment
-            print(f"Error calling Anthropic API: {str(e)}")
+            logger.error("Error calling Anthropic API: %s", e)
             return {
                 "content": "I'm sorry, I encountered an error while processing your request.",
                 "updated_context": context_data,
                 "error": str(e)
             }
 
+    async def stream_response(
+        self,
+        messages: List[Dict[str, Any]],
+        context: str = "{}",
+        settings: Optional[Dict[str, Any]] = None,
+    ) -> AsyncGenerator[str, None]:
+        """
+        Stream a response from Claude, one or more whole sentences at a time
+
+        Each piece ends at a sentence or line boundary so it can be sent on
+        while the rest is still being generated. Accepts the same settings
+        as generate_response.
+        """
+        if not messages:
+            yield "I'm sorry, I couldn't understand your message."
+            return
+
+        params = self._build_params(messages, settings)
+
+        pending = ""
+        started = False
+        try:
+            async with self.client.messages.stream(**params) as stream:
+                async for text in stream.text_stream:
+                    complete, pending = _split_complete(pending + text)
+                    if complete:
+                        started = True
+                        yield complete
+        except Exception as e:
+            if not started:
+                # Nothing was sent yet, so let the caller retry the message
+                raise
+            logger.error("Error calling Anthropic API: %s", e)
+            # Drop the unfinished sentence rather than send half of it
+            pending = "I'm sorry, I encountered an error while processing your request."
+
+        if pending:
+            yield pending
+
     async def execute_function_call(
         self, function_name: str, params: Dict[str, Any]
     ) -> Dict[str, Any]:
@@ -218,6 +312,50 @@ class AnthropicClient(LLMInterface):
         return {"result": f"Function {function_name} not implemented yet"}
 
 
+# Mock replies as (keywords, reply), checked in order against the lowered text
+_MOCK_RULES = (
+    (
+        ("hello", "hi"),
+        "Hello! Welcome to our WhatsApp shopping assistant. How can I help you today?",
+    ),
+    (
+        ("product", "shop"),
+        "We have a variety of products available. What are you looking for today?",
+    ),
+    (
+        ("order",),
+        "I can help you place an order. What would you like to purchase?",
+    ),
+)
+_MOCK_DEFAULT_REPLY = (
+    "I'm here to help you shop. You can ask about products, check your cart,"
+    " or place an order."
+)
+
+# Every keyword compiled into one pattern, with a group per rule, so a single
+# scan finds all matching rules. The lookahead lets matches overlap, so no
+# keyword can hide another.
+_MOCK_PATTERN = re.compile(
+    "(?=%s)"
+    % "|".join(
+        "(%s)" % "|".join(map(re.escape, keywords)) for keywords, _ in _MOCK_RULES
+    )
+)
+
+
+def _mock_reply(message: str) -> str:
+    """Return the reply of the first rule with a keyword in the lowered message"""
+    # Every alternative is a group, so lastindex is always set on a match
+    matched = {
+        match.lastindex
+        for match in _MOCK_PATTERN.finditer(message)
+        if match.lastindex is not None
+    }
+    if not matched:
+        return _MOCK_DEFAULT_REPLY
+    return _MOCK_RULES[min(matched) - 1][1]
+
+
 class MockLLMClient(LLMInterface):
     """Mock implementation of LLMInterface for testing and development"""
     
@@ -226,8 +364,8 @@ class MockLLMClient(LLMInterface):
     ) -> Dict[str, Any]:
         """Generate a mock response based on simple pattern matching"""
         try:
-            context_data = json.loads(context) if context else {}
-        except json.JSONDecodeError:
+            context_data = orjson.loads(context) if context else {}
+        except orjson.JSONDecodeError:
             context_data = {}
 
         last_user_message = ""
@@ -243,29 +381,10 @@ class MockLLMClient(LLMInterface):
             }
 
         # Simple response logic for demonstration purposes
-        if "hello" in last_user_message.lower() or "hi" in last_user_message.lower():
-            return {
-                "content": "Hello! Welcome to our WhatsApp shopping assistant. How can I help you today?",
-                "updated_context": context_data,
-            }
-        elif (
-            "product" in last_user_message.lower()
-            or "shop" in last_user_message.lower()
-        ):
-            return {
-                "content": "We have a variety of products available. What are you looking for today?",
-                "updated_context": context_data,
-            }
-        elif "order" in last_user_message.lower():
-            return {
-                "content": "I can help you place an order. What would you like to purchase?",
-                "updated_context": context_data,
-            }
-        else:
-            return {
-                "content": "I'm here to help you shop. You can ask about products, check your cart, or place an order.",
-                "updated_context": context_data,
-            }
+        return {
+            "content": _mock_reply(last_user_message.lower()),
+            "updated_context": context_data,
+        }
 
     async def execute_function_call(
         self, function_name: str, params: Dict[str, Any]
@@ -293,5 +412,7 @@ def create_llm_client(client_type: str = "anthropic") -> LLMInterface:
         raise ValueError(f"Unknown LLM client type: {client_type}")
 
 
-# For backward compatibility - defaults to the mock client
-LLMClient = MockLLMClient
\ No newline at end of file
+@lru_cache(maxsize=1)
+def get_llm_client() -> LLMInterface:
+    """Return the process-wide LLM client, creating it on first use"""
+    return create_llm_client(config.llm_provider)
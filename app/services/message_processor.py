@@ -1,17 +1,20 @@
-import json
+import logging
 from typing import Dict, Any, List, Optional, Union
 
-from anthropic import Anthropic
-
 from app.models.user import User
 from app.models.conversation import Conversation
 from app.models.message import Message
-from app.services.llm_client import AnthropicClient
-from app.messaging.twilio_adapter import TwilioWhatsAppAdapter
+from app.services.llm_client import get_llm_client
+from app.messaging.twilio_adapter import get_twilio_adapter
+from app.services.message_queue import NotRetryableError
+
+logger = logging.getLogger(__name__)
+
+# Initialize the messaging adapter; the LLM client is created on first use
+twilio_adapter = get_twilio_adapter()
 
-# Initialize the LLM client and messaging adapter
-llm_client = AnthropicClient()
-twilio_adapter = TwilioWhatsAppAdapter()
+# Most recent messages sent to the LLM each turn, bounding prompt size
+HISTORY_LIMIT = 20
 
 
 async def process_message(message_data: Dict[str, Any]) -> None:
@@ -39,35 +42,62 @@ async def process_message(message_data: Dict[str, Any]) -> None:
         media_url=message_data.get("media_url"),
         message_type=message_data.get("message_type", "text"),
         platform=message_data.get("platform", "whatsapp"),
-        metadata=message_data.get("metadata", {}),
+        metadata={"message_id": message_data.get("message_id")},
         raw_data=message_data.get("raw_data", {}),
     )
 
     # Get recent conversation messages for context
-    messages = await conversation.get_messages()
+    messages = await conversation.get_messages(limit=HISTORY_LIMIT)
 
-    # Generate response using LLM
-    response = await llm_client.generate_response(messages, conversation.context)
+    # Stream the reply, sending each finished sentence while the rest is
+    # still being generated. Only what was delivered is kept for storing.
+    delivered: List[str] = []
+    failure: Optional[Exception] = None
+    stream = get_llm_client().stream_response(messages, conversation.context)
+    try:
+        try:
+            async for piece in stream:
+                text = piece.strip()
+                if text:
+                    await twilio_adapter.send_message(phone_number, text)
+                delivered.append(piece)
+        finally:
+            # A failed send leaves the stream suspended; close it now so the
+            # API request is released instead of when it is collected
+            await stream.aclose()
+    except Exception as e:
+        if not delivered:
+            # Nothing reached the user and the user message is still only
+            # pending, so the queue can safely process this message again
+            raise
+        failure = e
 
     # Add assistant message to conversation
-    await conversation.add_message(
-        role="assistant",
-        content=response["content"],
-        phone_number=None,
-        message_type="text",
-        platform="system",
-    )
-
-    # Check for function calls and execute them
-    if "function_calls" in response:
-        # Process function calls here
-        # For now this is just a placeholder
-        pass
+    if delivered:
+        await conversation.add_message(
+            role="assistant",
+            content="".join(delivered),
+            phone_number=None,
+            message_type="text",
+            platform="system",
+        )
 
-    # Update conversation context if needed
-    if response.get("updated_context"):
-        conversation.context = json.dumps(response["updated_context"])
-        await conversation.update()
+    # Write the user message and the reply in one transaction, even if
+    # sending failed part way
+    try:
+        await conversation.flush_pending()
+    except Exception as e:
+        if not delivered:
+            raise
+        if failure is None:
+            failure = e
+        else:
+            # The send failure is the one worth reporting; this one is logged
+            logger.error("Could not store messages for %s: %s", phone_number, e)
 
-    # Send response back to user
-    await twilio_adapter.send_message(phone_number, response["content"])
+    if failure is not None:
+        # Part of the reply was sent, so processing the message again would
+        # send it twice
+        raise NotRetryableError(
+            f"Reply to {message_data.get('message_id')} failed after it was partly sent"
+        ) from failure
@@ -1,175 +1,566 @@
 import os
-import json
-from typing import Dict, Any, List, Optional, Union, Callable
+import random
+from collections import deque
+from typing import Awaitable, Deque, Dict, Any, List, Optional, Union, Callable
 import uuid
 import logging
 import asyncio
-import threading
-from queue import Queue
 from datetime import datetime
 from asyncio import Task, create_task
 
-logging.basicConfig(level=logging.INFO)
+import orjson
+
+from app.config import config
+
 logger = logging.getLogger(__name__)
 
+# Each worker logs a progress summary after this many messages
+_LOG_EVERY = 1000
 
-class ThreadSafeQueue:
-    """Thread-safe in-memory message queue with async worker support"""
+# Queued once per worker on shutdown to wake workers blocked on an empty queue
+_SENTINEL: Any = object()
+
+# Seconds shutdown waits for workers to finish their current batch
+_SHUTDOWN_GRACE = 10.0
+
+# A failed message is queued again this many times before it is dead-lettered,
+# waiting _RETRY_DELAY seconds longer before each attempt
+MAX_RETRIES = 3
+_RETRY_DELAY = 1.0
+
+# Dead letters kept for inspection; the oldest are dropped beyond this
+_DEAD_LETTER_LIMIT = 1000
+
+# Most messages a worker takes from the queue and processes together
+DEFAULT_BATCH_SIZE = 32
+
+# Most messages being processed at once across the whole worker pool
+DEFAULT_MAX_IN_FLIGHT = 64
+
+
+# Backoff after a failed message doubles from the base up to the cap, plus
+# up to the jitter so workers that failed together do not retry together
+_BACKOFF_BASE = 0.1
+_BACKOFF_MAX = 30.0
+_BACKOFF_JITTER = 0.1
+
+# After this many failures in a row a worker stops pulling messages for a
+# while. The pause is longer than any backoff, so opening the circuit always
+# slows a failing worker down further.
+_BREAKER_THRESHOLD = 10
+_BREAKER_OPEN_SECONDS = 60.0
+
+
+class QueueFullError(Exception):
+    """Raised when a message is offered to a queue that has no room left"""
+
+
+class NotRetryableError(Exception):
+    """Raised by a processor when a failed message must not be processed again
+
+    Such messages go straight to the dead letters, for example because part
+    of the work was already done and repeating it would duplicate it.
+    """
+
+
+class _CircuitBreaker:
+    """Consecutive-failure count for one worker, and how long it should pause"""
+
+    def __init__(
+        self,
+        threshold: int = _BREAKER_THRESHOLD,
+        open_seconds: float = _BREAKER_OPEN_SECONDS,
+    ):
+        self.threshold = threshold
+        self.open_seconds = open_seconds
+        self.consecutive_errors = 0
 
-    def __init__(self):
-        self.queue = Queue()
-        self._lock = threading.RLock()
-        self._event = asyncio.Event()
+    def record_success(self) -> None:
+        self.consecutive_errors = 0
+
+    def record_failure(self) -> None:
+        self.consecutive_errors += 1
+
+    @property
+    def is_open(self) -> bool:
+        return self.consecutive_errors >= self.threshold
+
+    def delay(self) -> float:
+        """Seconds to wait before pulling more messages"""
+        if not self.consecutive_errors:
+            return 0.0
+        if self.is_open:
+            # Stays at the threshold, so the first message after the pause
+            # either closes the circuit or opens it again
+            return self.open_seconds
+        backoff = min(_BACKOFF_MAX, _BACKOFF_BASE * 2**self.consecutive_errors)
+        return backoff + random.uniform(0, _BACKOFF_JITTER)
+
+
+class _PeekableQueue(asyncio.Queue):
+    """asyncio.Queue that can show its head without removing it"""
+
+    # Subclasses own _queue, the deque asyncio.Queue stores its items in; it
+    # is created by asyncio.Queue._init and is absent from the typeshed stubs
+    _queue: Deque[Any]
+
+    def peek_nowait(self) -> Any:
+        """Return the next item without removing it; raise QueueEmpty if none"""
+        if not self._queue:
+            raise asyncio.QueueEmpty
+        return self._queue[0]
+
+
+def _routing_key(message: Dict[str, Any]) -> Any:
+    """The key that keeps a sender's messages on one shard, in order"""
+    return message.get("phone_number") or message.get("id")
+
+
+class ThreadSafeQueue:
+    """In-memory message queue with async worker support
+
+    Producers and workers all run on the event loop, so asyncio queues are all
+    the synchronisation needed. Messages are split across shards by sender,
+    and each worker drains a single shard, so one sender's messages are
+    handled in arrival order and workers never compete for the same queue.
+    The exception is a retried message, which rejoins the back of its shard.
+    """
+
+    def __init__(self, maxsize: int = 0, num_shards: int = 1):
+        # Bounded so a burst of webhooks pushes back instead of growing memory;
+        # the bound is split evenly between the shards
+        self._shard_size = -(-maxsize // num_shards) if maxsize else 0
+        self._num_shards = num_shards
+        # The shard queues and the stop event are built on first use, inside
+        # the running loop; before Python 3.10 asyncio queues and events bind
+        # to the event loop that is current when they are created
+        self._shard_queues: Optional[List[_PeekableQueue]] = None
+        self._stop_event: Optional[asyncio.Event] = None
         self._workers: List[Task] = []
+        self._worker_shards: List[int] = []
         self._shutting_down = False
+        # Messages that failed every attempt
+        self.dead_letters: Deque[Dict[str, Any]] = deque(maxlen=_DEAD_LETTER_LIMIT)
+        # Retries waiting out their delay and the message each will queue
+        self._retries: Dict[Task, Dict[str, Any]] = {}
+
+    @property
+    def num_shards(self) -> int:
+        """Number of shards messages are split across"""
+        return self._num_shards
+
+    @property
+    def _shards(self) -> List[_PeekableQueue]:
+        if self._shard_queues is None:
+            self._shard_queues = [
+                _PeekableQueue(maxsize=self._shard_size)
+                for _ in range(self._num_shards)
+            ]
+        return self._shard_queues
+
+    @property
+    def _stopped(self) -> asyncio.Event:
+        """Set on shutdown to cut short any worker's backoff pause"""
+        if self._stop_event is None:
+            self._stop_event = asyncio.Event()
+        return self._stop_event
+
+    def _shard_for(self, message: Dict[str, Any]) -> _PeekableQueue:
+        """Return the shard a message belongs on"""
+        return self._shards[hash(_routing_key(message)) % self._num_shards]
 
     async def enqueue(self, message: Dict[str, Any]) -> None:
-        """Add a message to the queue in a thread-safe manner"""
-        with self._lock:
-            self.queue.put(message)
-            self._event.set()  # Signal that a new message is available
-
-    async def dequeue(self) -> Optional[Dict[str, Any]]:
-        """Remove and return a message from the queue in a thread-safe manner"""
-        # Wait for a message to be available
-        if self.queue.empty():
-            self._event.clear()
-            try:
-                # Wait for a message with a timeout
-                await asyncio.wait_for(self._event.wait(), timeout=1.0)
-            except asyncio.TimeoutError:
-                return None
+        """Add a message to the queue, waiting for room if it is full"""
+        await self._shard_for(message).put(message)
 
-        # Get a message from the queue with the lock
-        with self._lock:
-            if not self.queue.empty():
-                return self.queue.get()
-            return None
+    def try_enqueue(self, message: Dict[str, Any]) -> None:
+        """Add a message to the queue, raising QueueFullError if it is full"""
+        shard = self._shard_for(message)
+        try:
+            shard.put_nowait(message)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"Message queue shard is full ({shard.maxsize})")
+
+    async def dequeue(self, shard_id: int = 0) -> Dict[str, Any]:
+        """Remove and return a shard's next message, waiting until one arrives"""
+        return await self._shards[shard_id].get()
+
+    async def dequeue_batch(
+        self,
+        max_n: int = DEFAULT_BATCH_SIZE,
+        max_wait: float = 0.0,
+        shard_id: int = 0,
+    ) -> List[Dict[str, Any]]:
+        """Wait for one message, then take up to max_n, waiting max_wait seconds
+
+        With the default max_wait of 0 only messages already queued are added,
+        so a lone message is never delayed. A shutdown sentinel ends the batch
+        and is returned as its last item.
+        """
+        shard = self._shards[shard_id]
+        loop = asyncio.get_running_loop()
+        batch = [await shard.get()]
+        deadline = loop.time() + max_wait
+
+        while len(batch) < max_n and batch[-1] is not _SENTINEL:
+            try:
+                batch.append(shard.get_nowait())
+            except asyncio.QueueEmpty:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(shard.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+
+        return batch
+
+    @property
+    def length(self) -> int:
+        """Messages currently waiting across all shards"""
+        return sum(shard.qsize() for shard in self._shards)
 
     async def get_length(self) -> int:
-        """Get the current queue length in a thread-safe manner"""
-        with self._lock:
-            return self.queue.qsize()
-
-    async def peek(self) -> Optional[Dict[str, Any]]:
-        """View the next message without removing it"""
-        with self._lock:
-            if not self.queue.empty():
-                # This is not truly a peek since we can't peek at Queue, but we'll reinsert it
-                message = self.queue.get()
-                self.queue.put(message)  # Put it back
-                return message
-            return None
+        """Get the current queue length"""
+        return self.length
+
+    async def peek(self, shard_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+        """View a shard's next message, or the first shard's that has one"""
+        shards = self._shards if shard_id is None else [self._shards[shard_id]]
+        for shard in shards:
+            try:
+                return shard.peek_nowait()
+            except asyncio.QueueEmpty:
+                continue
+        return None
+
+    def get_dead_letters(self) -> List[Dict[str, Any]]:
+        """Return the messages that failed every attempt, oldest first"""
+        return list(self.dead_letters)
+
+    def _retry_or_dead_letter(
+        self, message: Dict[str, Any], retryable: bool = True
+    ) -> None:
+        """Schedule a failed message for another attempt or dead-letter it
+
+        A retried message goes to the back of its shard, so it is handled after
+        any messages its sender sent in the meantime.
+        """
+        retry_count = message.get("retry_count", 0) + 1
+        if not retryable or retry_count > MAX_RETRIES or self._shutting_down:
+            self._dead_letter(message)
+            logger.warning(
+                "Message %s dead-lettered after %d attempts",
+                message.get("id"),
+                retry_count,
+            )
+            return
+
+        message["retry_count"] = retry_count
+        retry = create_task(self._delayed_put(message, _RETRY_DELAY * retry_count))
+        self._retries[retry] = message
+        retry.add_done_callback(self._discard_retry)
+
+    def _dead_letter(self, message: Dict[str, Any]) -> None:
+        """Keep a message that will not be processed again"""
+        self.dead_letters.append(message)
+
+    def _discard_retry(self, retry: Task) -> None:
+        self._retries.pop(retry, None)
+
+    async def _delayed_put(self, message: Dict[str, Any], delay: float) -> None:
+        """Queue a message again once delay seconds have passed"""
+        await asyncio.sleep(delay)
+        await self._shard_for(message).put(message)
 
     async def register_worker(
-        self, worker_func: Callable[[Dict[str, Any]], Any]
+        self,
+        worker_func: Callable[[Dict[str, Any]], Any],
+        name: Optional[str] = None,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        in_flight: Optional[asyncio.Semaphore] = None,
+        shard_id: int = 0,
     ) -> None:
-        """Register an async worker function to process messages"""
-        worker_task = create_task(self._worker_loop(worker_func))
+        """Register an async worker function to process one shard's messages
+
+        Workers sharing an in_flight semaphore never process more messages at
+        once than it allows, however large their batches.
+        """
+        worker_task = create_task(
+            self._worker_loop(worker_func, batch_size, in_flight, shard_id),
+            name=name,
+        )
         self._workers.append(worker_task)
+        self._worker_shards.append(shard_id)
         logger.info(f"Registered worker task {id(worker_task)}")
 
-    async def _worker_loop(self, worker_func: Callable[[Dict[str, Any]], Any]) -> None:
-        """Internal async worker loop that processes messages from the queue"""
+    async def _worker_loop(
+        self,
+        worker_func: Callable[[Dict[str, Any]], Any],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        in_flight: Optional[asyncio.Semaphore] = None,
+        shard_id: int = 0,
+    ) -> None:
+        """Internal async worker loop that processes messages from a shard"""
         worker_id = id(asyncio.current_task())
         logger.info(f"Async worker {worker_id} started")
+        processed = 0
+        breaker = _CircuitBreaker()
 
         while not self._shutting_down:
             try:
-                message = await self.dequeue()
-                if message:
-                    # Process message with the worker function
-                    await self._safe_process_message(worker_func, message)
-                else:
-                    # No message available, just wait a bit to avoid CPU spinning
-                    await asyncio.sleep(0.1)
+                # Suspends until a message arrives, so idle workers cost nothing
+                batch = await self.dequeue_batch(batch_size, shard_id=shard_id)
+                stopping = batch[-1] is _SENTINEL
+                if stopping:
+                    batch.pop()
+                # Different senders are processed concurrently, each sender's
+                # messages one after another. Each message handles its own
+                # errors, so one failure cannot cancel the others.
+                by_sender: Dict[Any, List[Dict[str, Any]]] = {}
+                for message in batch:
+                    by_sender.setdefault(_routing_key(message), []).append(message)
+                await asyncio.gather(
+                    *(
+                        self._process_in_order(
+                            worker_func, messages, in_flight, breaker
+                        )
+                        for messages in by_sender.values()
+                    )
+                )
+                # Count instead of logging every message
+                before, processed = processed, processed + len(batch)
+                if processed // _LOG_EVERY != before // _LOG_EVERY:
+                    logger.info("Worker %d processed %d messages", worker_id, processed)
+                if stopping:
+                    break
             except Exception as e:
                 logger.error(f"Error in worker {worker_id}: {str(e)}")
-                await asyncio.sleep(1)  # Avoid tight loop in case of persistent errors
+                breaker.record_failure()
+
+            # Failing messages slow the worker down instead of draining its
+            # shard into an outage
+            delay = breaker.delay()
+            if delay:
+                if breaker.is_open:
+                    logger.warning(
+                        "Worker %d paused for %.0fs after %d consecutive errors",
+                        worker_id,
+                        delay,
+                        breaker.consecutive_errors,
+                    )
+                await self._pause(delay)
 
         logger.info(f"Worker {worker_id} shutting down")
 
+    async def _process_in_order(
+        self,
+        worker_func: Callable[[Dict[str, Any]], Any],
+        messages: List[Dict[str, Any]],
+        in_flight: Optional[asyncio.Semaphore] = None,
+        breaker: Optional[_CircuitBreaker] = None,
+    ) -> None:
+        """Process messages one at a time, in order"""
+        for message in messages:
+            await self._safe_process_message(worker_func, message, in_flight, breaker)
+
+    async def _pause(self, delay: float) -> None:
+        """Sleep for delay seconds, or until shutdown begins"""
+        try:
+            await asyncio.wait_for(self._stopped.wait(), delay)
+        except asyncio.TimeoutError:
+            pass
+
     async def _safe_process_message(
-        self, worker_func: Callable[[Dict[str, Any]], Any], message: Dict[str, Any]
+        self,
+        worker_func: Callable[[Dict[str, Any]], Any],
+        message: Dict[str, Any],
+        in_flight: Optional[asyncio.Semaphore] = None,
+        breaker: Optional[_CircuitBreaker] = None,
     ) -> None:
         """Safely process a message with error handling"""
+        if in_flight is not None:
+            async with in_flight:
+                await self._safe_process_message(worker_func, message, None, breaker)
+            return
+
+        # Per-message lines are debug only, and their arguments are only
+        # formatted when debug logging is on
+        debug = logger.isEnabledFor(logging.DEBUG)
         try:
-            worker_id = id(asyncio.current_task())
-            logger.info(
-                f"Processing message: {message.get('id')} in worker {worker_id}"
-            )
+            if debug:
+                logger.debug(
+                    "Processing message: %s in worker %d",
+                    message.get("id"),
+                    id(asyncio.current_task()),
+                )
             await worker_func(message)
-            logger.info(f"Successfully processed message: {message.get('id')}")
+            if breaker is not None:
+                breaker.record_success()
+            if debug:
+                logger.debug("Successfully processed message: %s", message.get("id"))
         except Exception as e:
-            logger.error(f"Error processing message {message.get('id')}: {str(e)}")
+            logger.error("Error processing message %s: %s", message.get("id"), e)
+            if breaker is not None:
+                breaker.record_failure()
+            self._retry_or_dead_letter(
+                message, retryable=not isinstance(e, NotRetryableError)
+            )
 
     async def shutdown(self) -> None:
         """Gracefully shutdown all worker tasks"""
         logger.info("Shutting down queue and worker tasks...")
         self._shutting_down = True
+        self._stopped.set()
+
+        # Retries still waiting would only land in a queue nobody drains, so
+        # their messages are dead-lettered instead of lost
+        waiting = [msg for retry, msg in self._retries.items() if not retry.done()]
+        for retry in list(self._retries):
+            retry.cancel()
+        self._retries.clear()
+        for message in waiting:
+            self._dead_letter(message)
+        if waiting:
+            logger.warning("Dead-lettered %d messages awaiting retry", len(waiting))
+
+        # Workers stop after their current batch. One sentinel per worker, on
+        # its own shard, wakes any that are waiting on an empty shard; a full
+        # shard has no waiters.
+        for shard_id in self._worker_shards:
+            try:
+                self._shards[shard_id].put_nowait(_SENTINEL)
+            except asyncio.QueueFull:
+                pass
 
-        # Cancel all worker tasks
-        for worker in self._workers:
-            if not worker.done():
-                worker.cancel()
-
-        # Wait for all tasks to complete
         if self._workers:
+            _, pending = await asyncio.wait(self._workers, timeout=_SHUTDOWN_GRACE)
+            # Cancel workers still busy once the grace period is over
+            for worker in pending:
+                worker.cancel()
             await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+        self._worker_shards.clear()
 
 
-# For simplicity, we'll use a thread-safe in-memory queue for now
+# For simplicity, we'll use an in-memory queue for now
 # In production, this would be replaced with Redis or another distributed queue
-message_queue = ThreadSafeQueue()
+# One shard per worker, so start_worker_pool must get the same worker count
+message_queue = ThreadSafeQueue(
+    maxsize=config.message_queue_max_size,
+    num_shards=config.message_worker_count,
+)
+
+
+# Bound once, since prepare_message runs for every inbound message
+_uuid4 = uuid.uuid4
+_now = datetime.now
 
 
-async def prepare_message(message: Dict[str, Any]) -> Dict[str, Any]:
+def prepare_message(message: Dict[str, Any]) -> Dict[str, Any]:
     """Prepare a message by adding required fields"""
-    # Add a unique ID if not present
+    # The ID and timestamp are only generated when the sender left them out
     if "id" not in message:
-        message["id"] = str(uuid.uuid4())
-
-    # Add timestamp if not present
+        message["id"] = _uuid4().hex
     if "timestamp" not in message:
-        message["timestamp"] = datetime.now().isoformat()
+        message["timestamp"] = _now().isoformat()
 
     # Ensure message_type is set
     if "message_type" not in message:
         message["message_type"] = "media" if message.get("media_url") else "text"
 
     # Ensure metadata exists
-    if "metadata" not in message:
-        message["metadata"] = {}
+    message.setdefault("metadata", {})
 
     return message
 
 
+# A distributed queue would carry messages as bytes; these are its wire format
+def serialize(message: Dict[str, Any]) -> bytes:
+    """Encode a prepared message as compact JSON bytes"""
+    return orjson.dumps(message)
+
+
+def deserialize(payload: bytes) -> Dict[str, Any]:
+    """Decode a message encoded by serialize"""
+    return orjson.loads(payload)
+
+
 async def enqueue_message(message: Dict[str, Any]) -> None:
-    """Add a message to the processing queue"""
-    prepared_message = await prepare_message(message)
+    """Add a message to the processing queue, waiting for room if it is full"""
+    prepared_message = prepare_message(message)
     await message_queue.enqueue(prepared_message)
 
 
+def try_enqueue_message(message: Dict[str, Any]) -> None:
+    """Add a message to the processing queue, raising QueueFullError if full"""
+    prepared_message = prepare_message(message)
+    message_queue.try_enqueue(prepared_message)
+
+
+# The coroutine that handles each message, registered once at startup rather
+# than imported on every message
+_processor: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None
+
+
+def set_processor(processor: Callable[[Dict[str, Any]], Awaitable[None]]) -> None:
+    """Register the coroutine the worker pool runs for each message"""
+    global _processor
+    _processor = processor
+
+
+def _ensure_processor() -> Callable[[Dict[str, Any]], Awaitable[None]]:
+    """Return the registered processor, registering process_message if none is"""
+    if _processor is None:
+        from app.services.message_processor import process_message
+
+        set_processor(process_message)
+        return process_message
+    return _processor
+
+
 async def process_messages() -> None:
     """Legacy message processor - starts a single worker"""
-    from app.services.message_processor import process_message
-
-    await message_queue.register_worker(process_message)
+    _ensure_processor()
+    await message_queue.register_worker(process_message_worker)
 
 
 async def process_message_worker(message: Dict[str, Any]) -> None:
     """Worker function that processes a single message"""
-    from app.services.message_processor import process_message
-
-    await process_message(message)
+    # Only an identity check once a processor is registered; a worker started
+    # without set_processor still gets the default one
+    await _ensure_processor()(message)
 
 
-async def start_worker_pool(num_workers: int = 3) -> None:
+async def start_worker_pool(
+    num_workers: int = 3,
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+) -> None:
     """Start a pool of async workers to process messages"""
     logger.info(f"Starting worker pool with {num_workers} workers")
+    _ensure_processor()
+
+    # One limit for the whole pool, so batching cannot multiply the number of
+    # concurrent LLM and database calls
+    in_flight = asyncio.Semaphore(max_in_flight)
+
+    # Exactly one worker per shard: a shard without one is never answered,
+    # and two draining the same shard would break per-sender ordering
+    if num_workers != message_queue.num_shards:
+        raise ValueError(
+            f"{num_workers} workers cannot serve {message_queue.num_shards} shards"
+        )
 
-    # Register the specified number of workers
+    # Register the specified number of workers, one per shard
     for i in range(num_workers):
-        await message_queue.register_worker(process_message_worker)
+        await message_queue.register_worker(
+            process_message_worker,
+            name=f"msg-worker-{i}",
+            batch_size=batch_size,
+            in_flight=in_flight,
+            shard_id=i,
+        )
 
     logger.info("Worker pool started successfully")
@@ -0,0 +1,12 @@
+import os
+import tempfile
+
+# Settings are read once, when app.config is first imported, so the test
+# environment has to be in place before any test module imports the app
+os.environ.setdefault("TWILIO_ACCOUNT_SID", "ACtest")
+os.environ.setdefault("TWILIO_AUTH_TOKEN", "test-auth-token")
+os.environ.setdefault("TWILIO_PHONE_NUMBER", "+15550000000")
+os.environ.setdefault("LLM_PROVIDER", "mock")
+os.environ.setdefault(
+    "DATABASE_PATH", os.path.join(tempfile.mkdtemp(), "ecommerce_bot.db")
+)
@@ -0,0 +1,369 @@
+import asyncio
+import sqlite3
+from datetime import datetime, timezone
+
+import pytest
+
+from app.models import database
+from app.models.database import _MIGRATIONS, Database
+from app.models.user import User
+
+# The schema as the first release created it, with ISO text timestamps and a
+# rowid product_categories table, for testing the upgrade path
+_BASELINE_SCHEMA = """
+	CREATE TABLE users (
+		phone_number TEXT PRIMARY KEY,
+		name TEXT,
+		created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+		last_interaction TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+		active_conversation_id TEXT
+	);
+	CREATE TABLE conversations (
+		id TEXT PRIMARY KEY,
+		user_id TEXT,
+		context TEXT,
+		active_product_id TEXT,
+		created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+		updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+	);
+	CREATE TABLE messages (
+		id TEXT PRIMARY KEY,
+		conversation_id TEXT,
+		role TEXT,
+		content TEXT,
+		phone_number TEXT,
+		media_url TEXT,
+		message_type TEXT DEFAULT 'text',
+		platform TEXT DEFAULT 'whatsapp',
+		metadata TEXT,
+		raw_data TEXT,
+		timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+	);
+	CREATE TABLE products (
+		id TEXT PRIMARY KEY,
+		name TEXT,
+		description TEXT,
+		price REAL,
+		image_url TEXT,
+		in_stock BOOLEAN
+	);
+	CREATE TABLE product_categories (
+		product_id TEXT,
+		category TEXT,
+		PRIMARY KEY (product_id, category)
+	);
+	CREATE TABLE cart_items (
+		id TEXT PRIMARY KEY,
+		conversation_id TEXT,
+		product_id TEXT,
+		quantity INTEGER
+	);
+	CREATE TABLE orders (
+		id TEXT PRIMARY KEY,
+		user_id TEXT,
+		total_amount REAL,
+		status TEXT,
+		created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+		updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+	);
+	CREATE TABLE order_items (
+		id TEXT PRIMARY KEY,
+		order_id TEXT,
+		product_id TEXT,
+		quantity INTEGER,
+		unit_price REAL
+	);
+	CREATE TABLE payments (
+		id TEXT PRIMARY KEY,
+		order_id TEXT,
+		provider TEXT,
+		payment_id TEXT,
+		payment_link TEXT,
+		status TEXT,
+		created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+		updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+	);
+	"""
+
+# The first release wrote datetime.now().isoformat(), i.e. local time
+LOCAL_ISO = "2024-03-01T12:30:00"
+# CURRENT_TIMESTAMP defaults are UTC
+UTC_SQL = "2024-03-01 12:30:00"
+
+
+def local_epoch(value):
+    return datetime.fromisoformat(value).timestamp()
+
+
+def utc_epoch(value):
+    return datetime.fromisoformat(value).replace(tzinfo=timezone.utc).timestamp()
+
+
+@pytest.fixture
+def db(tmp_path):
+    database = Database(str(tmp_path / "test.db"))
+    yield database
+    database.close()
+
+
+@pytest.fixture
+def baseline_db(tmp_path):
+    """A database file as the first release left it, with one row per table"""
+    path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(path)
+    conn.executescript(_BASELINE_SCHEMA)
+    conn.execute(
+        "INSERT INTO users (phone_number, name, created_at, last_interaction)"
+        " VALUES ('+1555', 'Ann', ?, ?)",
+        (UTC_SQL, LOCAL_ISO),
+    )
+    conn.execute(
+        "INSERT INTO conversations (id, user_id, context, created_at, updated_at)"
+        " VALUES ('c1', '+1555', '{}', ?, ?)",
+        (LOCAL_ISO, LOCAL_ISO),
+    )
+    conn.execute(
+        "INSERT INTO messages (id, conversation_id, role, content, timestamp)"
+        " VALUES ('m1', 'c1', 'user', 'hi', ?)",
+        (LOCAL_ISO,),
+    )
+    conn.execute(
+        "INSERT INTO products (id, name, description, price, in_stock)"
+        " VALUES ('p1', 'Red shirt', 'Cotton shirt', 10.0, 1)"
+    )
+    conn.execute("INSERT INTO product_categories VALUES ('p1', 'clothes')")
+    conn.execute(
+        "INSERT INTO orders (id, user_id, total_amount, status, created_at,"
+        " updated_at) VALUES ('o1', '+1555', 10.0, 'pending', ?, ?)",
+        (LOCAL_ISO, LOCAL_ISO),
+    )
+    conn.commit()
+    conn.close()
+
+    database = Database(path)
+    yield database
+    database.close()
+
+
+def test_new_database_starts_at_latest_version(db):
+    db.create_tables()
+    with db.connection() as conn:
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+    assert version == len(_MIGRATIONS)
+
+
+def test_migrations_upgrade_baseline_database(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.connection() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(_MIGRATIONS)
+
+
+def test_migrations_convert_conversation_timestamps(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.connection() as conn:
+        row = conn.execute("SELECT * FROM conversations WHERE id = 'c1'").fetchone()
+    assert row['created_at'] == pytest.approx(local_epoch(LOCAL_ISO))
+    assert row['updated_at'] == pytest.approx(local_epoch(LOCAL_ISO))
+
+
+def test_migrations_rebuild_product_categories_without_rowid(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.connection() as conn:
+        # Clustered on its key, so there is no rowid, and the rows are kept
+        with pytest.raises(sqlite3.OperationalError):
+            conn.execute("SELECT rowid FROM product_categories")
+        rows = conn.execute("SELECT product_id, category FROM product_categories")
+        assert [tuple(row) for row in rows] == [("p1", "clothes")]
+
+
+def test_migrations_convert_message_and_order_timestamps(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.connection() as conn:
+        message = conn.execute("SELECT timestamp FROM messages").fetchone()
+        order = conn.execute("SELECT created_at, updated_at FROM orders").fetchone()
+    assert message['timestamp'] == pytest.approx(local_epoch(LOCAL_ISO))
+    assert order['created_at'] == pytest.approx(local_epoch(LOCAL_ISO))
+    assert order['updated_at'] == pytest.approx(local_epoch(LOCAL_ISO))
+
+
+def test_migrations_index_the_existing_catalog(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.connection() as conn:
+        rows = conn.execute(
+            "SELECT product_id FROM products_fts WHERE products_fts MATCH 'shirt'"
+        )
+        assert [tuple(row) for row in rows] == [("p1",)]
+
+
+def test_migrations_convert_user_timestamps(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.connection() as conn:
+        row = conn.execute("SELECT * FROM users").fetchone()
+    # created_at came from the UTC default, last_interaction from the model
+    assert row['created_at'] == pytest.approx(utc_epoch(UTC_SQL))
+    assert row['last_interaction'] == pytest.approx(local_epoch(LOCAL_ISO))
+
+
+def test_migrations_are_not_reapplied(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.connection() as conn:
+        before = conn.execute("SELECT created_at FROM conversations").fetchone()[0]
+
+    baseline_db.create_tables()
+    with baseline_db.connection() as conn:
+        after = conn.execute("SELECT created_at FROM conversations").fetchone()[0]
+        indexed = conn.execute("SELECT COUNT(*) FROM products_fts").fetchone()[0]
+    assert after == before
+    assert indexed == 1
+
+
+def test_new_rows_in_migrated_database_get_epoch_timestamps(
+    baseline_db, monkeypatch
+):
+    baseline_db.create_tables()
+    monkeypatch.setattr(database, "_database", baseline_db)
+
+    async def scenario():
+        user = await User.create_or_update("+2")
+        await baseline_db.writes.close()
+        return user
+
+    user = asyncio.run(scenario())
+    assert isinstance(user.created_at, datetime)
+
+    # Rows that leave their timestamps to the column default get numbers too
+    with baseline_db.transaction() as cursor:
+        cursor.execute("INSERT INTO users (phone_number) VALUES ('+3')")
+    with baseline_db.connection() as conn:
+        row = conn.execute(
+            "SELECT typeof(created_at), typeof(last_interaction) FROM users"
+            " WHERE phone_number = '+3'"
+        ).fetchone()
+    assert tuple(row) == ("real", "real")
+
+
+def test_migrated_conversations_default_to_epoch_and_keep_the_trigger(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.transaction() as cursor:
+        cursor.execute("INSERT INTO conversations (id) VALUES ('c2')")
+        cursor.execute(
+            "INSERT INTO messages (id, conversation_id, timestamp)"
+            " VALUES ('m2', 'c1', 1700000000.0)"
+        )
+    with baseline_db.connection() as conn:
+        row = conn.execute(
+            "SELECT typeof(created_at), typeof(updated_at) FROM conversations"
+            " WHERE id = 'c2'"
+        ).fetchone()
+        assert tuple(row) == ("real", "real")
+        touched = conn.execute(
+            "SELECT updated_at FROM conversations WHERE id = 'c1'"
+        ).fetchone()[0]
+        assert touched == 1700000000.0
+
+
+def test_migrated_messages_and_orders_default_to_epoch(baseline_db):
+    baseline_db.create_tables()
+    with baseline_db.transaction() as cursor:
+        cursor.execute("INSERT INTO messages (id, conversation_id) VALUES ('m2', 'c1')")
+        cursor.execute("INSERT INTO orders (id, user_id) VALUES ('o2', '+1555')")
+    with baseline_db.connection() as conn:
+        message = conn.execute(
+            "SELECT typeof(timestamp) FROM messages WHERE id = 'm2'"
+        ).fetchone()
+        order = conn.execute(
+            "SELECT typeof(created_at), typeof(updated_at) FROM orders"
+            " WHERE id = 'o2'"
+        ).fetchone()
+        # Existing rows survive the rebuild
+        kept = conn.execute("SELECT content FROM messages WHERE id = 'm1'").fetchone()
+    assert tuple(message) == ("real",)
+    assert tuple(order) == ("real", "real")
+    assert kept[0] == "hi"
+
+
+def test_rebuilds_replace_existing_triggers_and_indexes(db):
+    # A database migrated by an earlier release already has every trigger and
+    # index, which the table rebuilds must drop and recreate
+    db.create_tables()
+    with db.connection(write=True) as conn:
+        conn.execute("PRAGMA user_version = 5")
+    db.create_tables()
+    with db.connection() as conn:
+        assert conn.execute("PRAGMA user_version").fetchone()[0] == len(_MIGRATIONS)
+        names = {
+            row[0]
+            for row in conn.execute(
+                "SELECT name FROM sqlite_master WHERE type IN ('index', 'trigger')"
+            )
+        }
+    assert {"idx_msg_conv_ts", "idx_orders_user_ts", "trg_msg_touch_conv"} <= names
+
+
+def test_write_batcher_commits_a_batch_together(db):
+    db.create_tables()
+
+    async def scenario():
+        await asyncio.gather(
+            *(
+                db.writes.execute(
+                    "INSERT INTO users (phone_number, name) VALUES (?, ?)",
+                    (f"+{n}", f"User {n}"),
+                )
+                for n in range(5)
+            )
+        )
+        await db.writes.close()
+
+    asyncio.run(scenario())
+    with db.connection() as conn:
+        assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 5
+
+
+def test_write_batcher_isolates_a_failing_write(db):
+    db.create_tables()
+    with db.transaction() as cursor:
+        cursor.execute("INSERT INTO users (phone_number, name) VALUES ('+1', 'Ann')")
+
+    async def scenario():
+        # Queued together, so they share one transaction until the duplicate
+        # primary key aborts it
+        results = await asyncio.gather(
+            db.writes.execute(
+                "INSERT INTO users (phone_number, name) VALUES ('+2', 'Bob')"
+            ),
+            db.writes.execute(
+                "INSERT INTO users (phone_number, name) VALUES ('+1', 'Dup')"
+            ),
+            db.writes.execute(
+                "INSERT INTO users (phone_number, name) VALUES ('+3', 'Cy')"
+            ),
+            return_exceptions=True,
+        )
+        await db.writes.close()
+        return results
+
+    ok_before, failed, ok_after = asyncio.run(scenario())
+    assert ok_before == [] and ok_after == []
+    assert isinstance(failed, sqlite3.IntegrityError)
+    with db.connection() as conn:
+        names = conn.execute("SELECT phone_number, name FROM users ORDER BY 1")
+        assert [tuple(row) for row in names] == [
+            ("+1", "Ann"),
+            ("+2", "Bob"),
+            ("+3", "Cy"),
+        ]
+
+
+def test_write_batcher_returns_returning_rows(db):
+    db.create_tables()
+
+    async def scenario():
+        rows = await db.writes.execute(
+            "INSERT INTO users (phone_number, name) VALUES ('+1', 'Ann')"
+            " RETURNING phone_number"
+        )
+        await db.writes.close()
+        return rows
+
+    assert [tuple(row) for row in asyncio.run(scenario())] == [("+1",)]
@@ -0,0 +1,101 @@
+import asyncio
+
+import pytest
+from cachetools import LRUCache
+
+from app.services.llm_client import AnthropicClient, _split_complete
+
+
+@pytest.mark.parametrize(
+    "text, expected",
+    [
+        ("", ("", "")),
+        ("No boundary yet", ("", "No boundary yet")),
+        ("Hello. Wor", ("Hello. ", "Wor")),
+        ("Hi! How are you? I", ("Hi! How are you? ", "I")),
+        ("First line\nsecond", ("First line\n", "second")),
+        ("Done. ", ("Done. ", "")),
+    ],
+)
+def test_split_complete_splits_after_last_boundary(text, expected):
+    assert _split_complete(text) == expected
+
+
+def test_split_complete_keeps_a_final_stop_without_whitespace_pending():
+    # The next chunk of the stream may still continue the sentence
+    assert _split_complete("Hi! Fine.") == ("Hi! ", "Fine.")
+
+
+def test_split_complete_does_not_split_decimals():
+    assert _split_complete("It costs 3.5 dollars. Ok") == (
+        "It costs 3.5 dollars. ",
+        "Ok",
+    )
+
+
+class FakeStream:
+    """Stands in for the SDK's message stream, failing at chunk `fail_at`"""
+
+    def __init__(self, chunks, fail_at=None):
+        self.chunks = chunks
+        self.fail_at = fail_at
+
+    async def __aenter__(self):
+        self.text_stream = self._text()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    async def _text(self):
+        for n, chunk in enumerate(self.chunks):
+            if n == self.fail_at:
+                raise RuntimeError("overloaded")
+            yield chunk
+
+
+class FakeMessages:
+    def __init__(self, stream):
+        self._stream = stream
+
+    def stream(self, **params):
+        return self._stream
+
+
+def anthropic_client(stream):
+    """An AnthropicClient whose API calls return the given stream"""
+    client = AnthropicClient.__new__(AnthropicClient)
+    client.default_model = "model"
+    client.default_max_tokens = 10
+    client._api_tools_cache = LRUCache(maxsize=1)
+    client.client = type("FakeAPI", (), {"messages": FakeMessages(stream)})()
+    return client
+
+
+def collect(client):
+    messages = [{"role": "user", "content": "hi"}]
+
+    async def scenario():
+        return [piece async for piece in client.stream_response(messages)]
+
+    return asyncio.run(scenario())
+
+
+def test_stream_response_yields_whole_sentences():
+    client = anthropic_client(FakeStream(["Hel", "lo. How", " are you?"]))
+    assert collect(client) == ["Hello. ", "How are you?"]
+
+
+def test_stream_response_raises_when_nothing_was_yielded():
+    # The caller has sent nothing, so it can retry instead of apologising
+    client = anthropic_client(FakeStream(["Hel", "lo."], fail_at=1))
+    with pytest.raises(RuntimeError):
+        collect(client)
+
+
+def test_stream_response_apologises_after_partial_output():
+    stream = FakeStream(["Hello. ", "How", " are"], fail_at=2)
+    client = anthropic_client(stream)
+    first, apology = collect(client)
+    assert first == "Hello. "
+    assert apology.startswith("I'm sorry")
@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+
+from app.models import database
+from app.models.database import Database
+from app.services import message_processor
+from app.services.message_queue import NotRetryableError
+
+REPLY = ["One. ", "Two. ", "Three."]
+
+
+class StreamingClient:
+    """LLM client that streams a fixed reply"""
+
+    async def stream_response(self, messages, context):
+        for piece in REPLY:
+            yield piece
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    db = Database(str(tmp_path / "test.db"))
+    db.create_tables()
+    monkeypatch.setattr(database, "_database", db)
+    yield db
+    db.close()
+
+
+class FakeSender:
+    """Records delivered texts; the send numbered fail_at raises instead"""
+
+    def __init__(self):
+        self.sent = []
+        self.fail_at = None
+
+    async def send_message(self, phone_number, text):
+        if len(self.sent) == self.fail_at:
+            self.fail_at = None
+            raise RuntimeError("Twilio unavailable")
+        self.sent.append(text)
+
+
+@pytest.fixture
+def twilio(monkeypatch):
+    sender = FakeSender()
+    monkeypatch.setattr(
+        message_processor.twilio_adapter, "send_message", sender.send_message
+    )
+    monkeypatch.setattr(message_processor, "get_llm_client", StreamingClient)
+    return sender
+
+
+def process(message):
+    """Process one message, returning the exception it raised, if any"""
+
+    async def scenario():
+        try:
+            await message_processor.process_message(message)
+            return None
+        except Exception as e:
+            return e
+        finally:
+            # The database write queue belongs to this event loop, so drain
+            # it before the loop closes
+            await database.get_database().writes.close()
+
+    return asyncio.run(scenario())
+
+
+def stored_messages(db):
+    with db.connection() as conn:
+        rows = conn.execute("SELECT role, content FROM messages ORDER BY timestamp")
+        return [tuple(row) for row in rows]
+
+
+def incoming(phone_number):
+    return {"phone_number": phone_number, "content": "hello", "message_id": "SM1"}
+
+
+def test_reply_is_sent_and_stored(db, twilio):
+    assert process(incoming("+15551000001")) is None
+    assert twilio.sent == ["One.", "Two.", "Three."]
+    assert stored_messages(db) == [
+        ("user", "hello"),
+        ("assistant", "One. Two. Three."),
+    ]
+
+
+def test_failure_before_any_send_stores_nothing(db, twilio):
+    twilio.fail_at = 0
+
+    async def failing_then_retried():
+        message = incoming("+15551000002")
+        with pytest.raises(RuntimeError):
+            await message_processor.process_message(dict(message))
+        # Nothing was sent or stored, so processing the message again is safe
+        assert twilio.sent == []
+        assert stored_messages(db) == []
+        await message_processor.process_message(dict(message))
+        await database.get_database().writes.close()
+
+    asyncio.run(failing_then_retried())
+    assert twilio.sent == ["One.", "Two.", "Three."]
+    assert stored_messages(db) == [
+        ("user", "hello"),
+        ("assistant", "One. Two. Three."),
+    ]
+
+
+def test_failure_after_a_send_stores_only_what_was_delivered(db, twilio):
+    twilio.fail_at = 1
+    error = process(incoming("+15551000003"))
+    assert isinstance(error, NotRetryableError)
+    assert twilio.sent == ["One."]
+    assert stored_messages(db) == [("user", "hello"), ("assistant", "One. ")]
+
+
+def test_failed_send_closes_the_stream(db, twilio, monkeypatch):
+    streams = []
+
+    class TrackedClient(StreamingClient):
+        def stream_response(self, messages, context):
+            # Holding a reference keeps the garbage collector from closing it
+            streams.append(super().stream_response(messages, context))
+            return streams[-1]
+
+    monkeypatch.setattr(message_processor, "get_llm_client", TrackedClient)
+    twilio.fail_at = 1
+
+    async def scenario():
+        with pytest.raises(NotRetryableError):
+            await message_processor.process_message(incoming("+15551000004"))
+        # Checked before asyncio.run would close it on the way out
+        closed = streams[0].ag_frame is None
+        await database.get_database().writes.close()
+        return closed
+
+    assert asyncio.run(scenario())
@@ -0,0 +1,255 @@
+import asyncio
+import time
+
+import pytest
+
+from app.services import message_queue as mq
+from app.services.message_queue import (
+    NotRetryableError,
+    QueueFullError,
+    ThreadSafeQueue,
+    _CircuitBreaker,
+    _routing_key,
+)
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    """Retry and back off almost at once so tests run quickly"""
+    monkeypatch.setattr(mq, "_RETRY_DELAY", 0.001)
+    monkeypatch.setattr(mq, "_BACKOFF_BASE", 0.001)
+    monkeypatch.setattr(mq, "_BACKOFF_JITTER", 0.0)
+
+
+async def wait_until(predicate, timeout=2.0):
+    """Poll until predicate() is true, failing the test after timeout seconds"""
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline, "condition not reached in time"
+        await asyncio.sleep(0.005)
+
+
+def message(sender, n):
+    return {"id": f"{sender}-{n}", "phone_number": sender, "n": n}
+
+
+@pytest.mark.usefixtures("fast_retries")
+def test_failed_message_is_retried_until_it_succeeds():
+    async def scenario():
+        queue = ThreadSafeQueue(maxsize=10)
+        attempts = []
+
+        async def flaky(msg):
+            attempts.append(msg.get("retry_count", 0))
+            if len(attempts) < 3:
+                raise RuntimeError("downstream unavailable")
+
+        await queue.register_worker(flaky, name="worker")
+        queue.try_enqueue(message("+1", 1))
+        await wait_until(lambda: len(attempts) == 3)
+        await queue.shutdown()
+        return attempts, queue.get_dead_letters()
+
+    attempts, dead_letters = asyncio.run(scenario())
+    assert attempts == [0, 1, 2]
+    assert dead_letters == []
+
+
+@pytest.mark.usefixtures("fast_retries")
+def test_message_is_dead_lettered_after_max_retries():
+    async def scenario():
+        queue = ThreadSafeQueue(maxsize=10)
+        attempts = []
+
+        async def broken(msg):
+            attempts.append(msg["id"])
+            raise RuntimeError("downstream unavailable")
+
+        await queue.register_worker(broken, name="worker")
+        queue.try_enqueue(message("+1", 1))
+        await wait_until(lambda: bool(queue.get_dead_letters()))
+        await queue.shutdown()
+        return attempts, queue.get_dead_letters()
+
+    attempts, dead_letters = asyncio.run(scenario())
+    assert len(attempts) == mq.MAX_RETRIES + 1
+    assert dead_letters == [{**message("+1", 1), "retry_count": mq.MAX_RETRIES}]
+
+
+@pytest.mark.usefixtures("fast_retries")
+def test_not_retryable_error_is_dead_lettered_at_once():
+    async def scenario():
+        queue = ThreadSafeQueue(maxsize=10)
+        attempts = []
+
+        async def partly_sent(msg):
+            attempts.append(msg["id"])
+            raise NotRetryableError("reply was partly sent")
+
+        await queue.register_worker(partly_sent, name="worker")
+        queue.try_enqueue(message("+1", 1))
+        await wait_until(lambda: bool(queue.get_dead_letters()))
+        await queue.shutdown()
+        return attempts, queue.get_dead_letters()
+
+    attempts, dead_letters = asyncio.run(scenario())
+    assert attempts == ["+1-1"]
+    assert [m["id"] for m in dead_letters] == ["+1-1"]
+
+
+@pytest.mark.usefixtures("fast_retries")
+def test_shutdown_dead_letters_pending_retries(monkeypatch):
+    monkeypatch.setattr(mq, "_RETRY_DELAY", 60.0)
+
+    async def scenario():
+        queue = ThreadSafeQueue(maxsize=10)
+        attempts = []
+
+        async def broken(msg):
+            attempts.append(msg["id"])
+            raise RuntimeError("downstream unavailable")
+
+        await queue.register_worker(broken, name="worker")
+        queue.try_enqueue(message("+1", 1))
+        await wait_until(lambda: bool(attempts))
+        await wait_until(lambda: bool(queue._retries))
+        await queue.shutdown()
+        return queue.get_dead_letters(), queue._retries
+
+    dead_letters, retries = asyncio.run(scenario())
+    assert [(m["id"], m["retry_count"]) for m in dead_letters] == [("+1-1", 1)]
+    assert not retries
+
+
+def test_breaker_backoff_grows_and_opens_at_threshold():
+    breaker = _CircuitBreaker()
+    assert breaker.delay() == 0.0
+
+    delays = []
+    for _ in range(breaker.threshold):
+        breaker.record_failure()
+        delays.append(breaker.delay())
+
+    backoffs, opened = delays[:-1], delays[-1]
+    assert backoffs == sorted(backoffs)
+    assert max(backoffs) <= mq._BACKOFF_MAX + mq._BACKOFF_JITTER
+    assert breaker.is_open
+    assert opened == breaker.open_seconds
+    # Opening the circuit never shortens the wait
+    assert opened >= max(backoffs)
+
+
+def test_breaker_backoff_is_capped(monkeypatch):
+    monkeypatch.setattr(mq, "_BACKOFF_JITTER", 0.0)
+    breaker = _CircuitBreaker(threshold=100)
+    for _ in range(20):
+        breaker.record_failure()
+    assert breaker.delay() == mq._BACKOFF_MAX
+
+
+def test_default_open_pause_exceeds_longest_backoff():
+    assert mq._BREAKER_OPEN_SECONDS >= mq._BACKOFF_MAX
+
+
+def test_breaker_resets_on_success():
+    breaker = _CircuitBreaker(threshold=2)
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.is_open
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.delay() == 0.0
+
+
+def test_messages_from_one_sender_share_a_shard():
+    async def scenario():
+        queue = ThreadSafeQueue(maxsize=100, num_shards=4)
+        for n in range(20):
+            queue.try_enqueue(message(f"+{n % 5}", n))
+        shards = {}
+        for shard_id in range(queue.num_shards):
+            while queue._shards[shard_id].qsize():
+                msg = await queue.dequeue(shard_id)
+                shards.setdefault(msg["phone_number"], set()).add(shard_id)
+        return shards
+
+    shards = asyncio.run(scenario())
+    assert len(shards) == 5
+    assert all(len(ids) == 1 for ids in shards.values())
+
+
+def test_routing_key_falls_back_to_message_id():
+    assert _routing_key({"id": "abc"}) == "abc"
+    assert _routing_key({"id": "abc", "phone_number": "+1"}) == "+1"
+
+
+@pytest.mark.usefixtures("fast_retries")
+def test_workers_keep_each_senders_order():
+    async def scenario():
+        queue = ThreadSafeQueue(maxsize=100, num_shards=2)
+        handled = []
+
+        async def record(msg):
+            # Later messages finish sooner, so only ordering keeps them in line
+            await asyncio.sleep(0.001 * (10 - msg["n"] % 10))
+            handled.append((msg["phone_number"], msg["n"]))
+
+        for shard_id in range(queue.num_shards):
+            await queue.register_worker(record, name="worker", shard_id=shard_id)
+        for n in range(30):
+            queue.try_enqueue(message(f"+{n % 3}", n))
+        await wait_until(lambda: len(handled) == 30)
+        await queue.shutdown()
+        return handled
+
+    handled = asyncio.run(scenario())
+    for sender in ("+0", "+1", "+2"):
+        numbers = [n for s, n in handled if s == sender]
+        assert numbers == sorted(numbers)
+
+
+def test_full_shard_raises_queue_full():
+    async def scenario():
+        queue = ThreadSafeQueue(maxsize=2)
+        queue.try_enqueue(message("+1", 1))
+        queue.try_enqueue(message("+1", 2))
+        with pytest.raises(QueueFullError):
+            queue.try_enqueue(message("+1", 3))
+        return queue.length
+
+    assert asyncio.run(scenario()) == 2
+
+
+def test_shutdown_wakes_idle_workers_with_sentinels():
+    async def scenario():
+        queue = ThreadSafeQueue(maxsize=10, num_shards=3)
+
+        async def unused(msg):
+            raise AssertionError("no message was queued")
+
+        for shard_id in range(queue.num_shards):
+            await queue.register_worker(unused, name="worker", shard_id=shard_id)
+        workers = list(queue._workers)
+        await asyncio.sleep(0.01)
+
+        started = time.monotonic()
+        await queue.shutdown()
+        return workers, time.monotonic() - started
+
+    workers, elapsed = asyncio.run(scenario())
+    # Woken by their sentinels rather than cancelled after the grace period
+    assert elapsed < mq._SHUTDOWN_GRACE / 10
+    assert all(worker.done() and not worker.cancelled() for worker in workers)
+
+
+@pytest.mark.parametrize("extra", [-1, 1])
+def test_start_worker_pool_needs_one_worker_per_shard(extra):
+    # Too few leaves a shard unanswered; too many would share a shard
+    async def scenario():
+        with pytest.raises(ValueError):
+            await mq.start_worker_pool(mq.message_queue.num_shards + extra)
+        assert mq.message_queue._workers == []
+
+    # One shard per configured worker, three by default
+    assert mq.message_queue.num_shards > 1
+    asyncio.run(scenario())
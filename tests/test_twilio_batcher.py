@@ -0,0 +1,56 @@
+import asyncio
+
+from app.messaging.twilio_adapter import TwilioSendBatcher
+
+
+def test_batch_is_sent_together():
+    async def scenario():
+        sent = []
+
+        async def send(data):
+            sent.append(data["n"])
+            return {"n": data["n"]}
+
+        batcher = TwilioSendBatcher(send, max_batch=8)
+        results = await asyncio.gather(*(batcher.submit({"n": n}) for n in range(3)))
+        await batcher.close()
+        return sent, results
+
+    sent, results = asyncio.run(scenario())
+    assert sent == [0, 1, 2]
+    assert results == [{"n": 0}, {"n": 1}, {"n": 2}]
+
+
+def test_close_fails_sends_in_flight_and_queued():
+    async def scenario():
+        started = asyncio.Event()
+
+        async def stalled(data):
+            started.set()
+            await asyncio.Event().wait()
+
+        batcher = TwilioSendBatcher(stalled, max_batch=1)
+        # The first send is in flight when close() runs; the second is queued
+        sends = [asyncio.ensure_future(batcher.submit({"n": n})) for n in range(2)]
+        await started.wait()
+        await batcher.close()
+        return await asyncio.wait_for(
+            asyncio.gather(*sends, return_exceptions=True), timeout=1
+        )
+
+    results = asyncio.run(scenario())
+    assert [type(result) for result in results] == [RuntimeError, RuntimeError]
+
+
+def test_batcher_can_be_used_again_after_close():
+    async def scenario():
+        async def send(data):
+            return data
+
+        batcher = TwilioSendBatcher(send)
+        await batcher.close()
+        result = await batcher.submit({"n": 1})
+        await batcher.close()
+        return result
+
+    assert asyncio.run(scenario()) == {"n": 1}
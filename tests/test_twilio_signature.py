@@ -0,0 +1,128 @@
+import base64
+import hashlib
+import hmac
+from urllib.parse import urlencode
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.api import webhook
+from app.config import config
+from app.messaging.twilio_adapter import _other_port_form
+
+URL = "http://testserver/webhook/whatsapp"
+FORM = "application/x-www-form-urlencoded"
+
+
+def twilio_signature(url, pairs):
+    """Sign a URL and its POST params the way Twilio documents it"""
+    payload = url + "".join(key + value for key, value in sorted(pairs))
+    mac = hmac.new(config.twilio_auth_token.encode(), payload.encode(), hashlib.sha1)
+    return base64.b64encode(mac.digest()).decode()
+
+
+PARAMS = [("From", "whatsapp:+15551234567"), ("Body", "hi"), ("MessageSid", "SM1")]
+
+
+@pytest.fixture
+def adapter():
+    return webhook.twilio_adapter
+
+
+def test_valid_signature_over_raw_body(adapter):
+    body = urlencode(PARAMS).encode()
+    assert adapter.validate_signature_raw(URL, body, twilio_signature(URL, PARAMS))
+
+
+def test_signature_rejects_altered_body(adapter):
+    signature = twilio_signature(URL, PARAMS)
+    tampered = urlencode([(k, "evil" if k == "Body" else v) for k, v in PARAMS])
+    assert not adapter.validate_signature_raw(URL, tampered.encode(), signature)
+
+
+def test_signature_rejects_other_url(adapter):
+    body = urlencode(PARAMS).encode()
+    signature = twilio_signature(URL, PARAMS)
+    assert not adapter.validate_signature_raw(URL + "?x=1", body, signature)
+
+
+@pytest.mark.parametrize(
+    "received, signed",
+    [
+        # A proxy dropped the default port Twilio signed with
+        ("https://example.com/hook", "https://example.com:443/hook"),
+        # or added one Twilio left out
+        ("https://example.com:443/hook", "https://example.com/hook"),
+        ("http://example.com:8080/hook", "http://example.com/hook"),
+    ],
+)
+def test_signature_is_checked_with_and_without_port(adapter, received, signed):
+    body = urlencode(PARAMS).encode()
+    signature = twilio_signature(signed, PARAMS)
+    assert adapter.validate_signature_raw(received, body, signature)
+
+
+def test_other_port_form_keeps_the_rest_of_the_url():
+    assert (
+        _other_port_form("https://example.com/webhook?x=1")
+        == "https://example.com:443/webhook?x=1"
+    )
+    assert _other_port_form("http://[::1]:8000/hook") == "http://[::1]/hook"
+
+
+@pytest.mark.parametrize("signature", [None, ""])
+def test_missing_signature_is_invalid(adapter, signature):
+    body = urlencode(PARAMS).encode()
+    assert not adapter.validate_signature_raw(URL, body, signature)
+
+
+def test_repeated_keys_are_all_signed(adapter):
+    # A dict of the form data would keep only one MediaUrl value
+    pairs = PARAMS + [("MediaUrl", "a"), ("MediaUrl", "b")]
+    body = urlencode(pairs).encode()
+    assert adapter.validate_signature_raw(URL, body, twilio_signature(URL, pairs))
+    collapsed = twilio_signature(URL, dict(pairs).items())
+    assert not adapter.validate_signature_raw(URL, body, collapsed)
+
+
+def test_non_utf8_body_is_invalid(adapter):
+    assert not adapter.validate_signature_raw(URL, b"Body=\xff", "sig")
+
+
+@pytest.fixture
+def client(monkeypatch):
+    enqueued = []
+    monkeypatch.setattr(webhook, "try_enqueue_message", enqueued.append)
+    app = FastAPI()
+    app.include_router(webhook.router)
+    with TestClient(app) as test_client:
+        test_client.enqueued = enqueued
+        yield test_client
+
+
+def test_webhook_accepts_signed_request(client):
+    response = client.post(
+        "/webhook/whatsapp",
+        content=urlencode(PARAMS),
+        headers={
+            "content-type": FORM,
+            "x-twilio-signature": twilio_signature(URL, PARAMS),
+        },
+    )
+    assert response.status_code == 200
+    assert [m["content"] for m in client.enqueued] == ["hi"]
+
+
+def test_webhook_rejects_forged_request(client):
+    forged = [(k, "evil" if k == "Body" else v) for k, v in PARAMS]
+    response = client.post(
+        "/webhook/whatsapp",
+        content=urlencode(forged),
+        headers={
+            "content-type": FORM,
+            "x-twilio-signature": twilio_signature(URL, PARAMS),
+        },
+    )
+    assert response.status_code == 401
+    assert client.enqueued == []